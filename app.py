@@ -1,51 +1,67 @@
 import streamlit as st
-import fitz  # PyMuPDF
-from docx import Document
-import speech_recognition as sr
 import preprocess as pp
 import model as md
-import shelve
-import time
-import base64
+from docstore import DocumentStore, process_job
+import jobs
+import metrics
+from chat_ui import (NO_ANSWER, load_history, load_earlier_history, save_history, delete_history, archive_history,
+                     restore_history, start_new_chat, processing_status, debug_panel, stream_summary,
+                     warm_up_models, show_notification)
+import doc_cache
 
 st.set_page_config(page_title="Chat with multiple PDFs", page_icon=":books:", layout="wide")
 
 USER_AVATAR = "👤"
 BOT_AVATAR = "🤖"
 
-# Load chat history from shelve file
-def load_history(name="chat_history"):
-    with shelve.open(name) as db:
-        return db.get("messages", [])
+# Pages shown at once and the resolution they are rendered at
+PREVIEW_PAGES = 2
+PREVIEW_DPI = 100
 
-# Save chat history to shelve file
-def save_history(messages, name="chat_history"):
-    with shelve.open(name) as db:
-        db["messages"] = messages
+# Rendered pages are memoized by file hash and page number, the bytes are
+# passed along (underscore: not hashed by Streamlit) only to render a miss
+@st.cache_data(max_entries=256, show_spinner=False)
+def render_pdf_page(digest, page_no, _data, dpi=PREVIEW_DPI):
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=_data, filetype="pdf") as pdf:
+        # A zoom matrix instead of dpi=, which the pinned PyMuPDF 1.18 does not have
+        zoom = dpi / 72
+        return pdf[page_no].get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+
+@st.cache_data(show_spinner=False)
+def pdf_page_count(digest, _data):
+    import fitz
+
+    with fitz.open(stream=_data, filetype="pdf") as pdf:
+        return pdf.page_count
 
 def preview_pdf(file):
-    file.seek(0)  # Ensure the file pointer is at the beginning
-    base64_pdf = base64.b64encode(file.read()).decode('utf-8')
-    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="850" type="application/pdf"></iframe>'
-    st.markdown(pdf_display, unsafe_allow_html=True)
+    data = file.getvalue()
+    digest = doc_cache.content_hash(data)
+    n_pages = pdf_page_count(digest, data)
+    if n_pages == 0:
+        return
+    first = st.number_input(f"{file.name} ({n_pages} pages)", min_value=1, max_value=n_pages, value=1,
+                            step=PREVIEW_PAGES, key=f"preview_page_{digest}")
+    for page_no in range(first - 1, min(first - 1 + PREVIEW_PAGES, n_pages)):
+        st.image(render_pdf_page(digest, page_no, data), caption=f"Page {page_no + 1}")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def docx_text(digest, _file):
+    from docx import Document
+
+    doc = Document(_file)
+    return "\n".join(p.text for p in doc.paragraphs)
 
 def preview_docx(file):
-    doc = Document(file)
-    paragraphs = [p.text for p in doc.paragraphs]
-    preview_text = "\n".join(paragraphs)
+    preview_text = docx_text(doc_cache.content_hash(file.getvalue()), file)
     st.text_area(file.name, preview_text, height=600)
 
 def preview_txt(file):
     content = file.read().decode("utf-8")
     st.text_area(file.name, content, height=600)
 
-@st.cache_data
-def displayPDF(file):
-    with open(file, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-    pdf_display = F'<iframe src = "data:application/pdf; base64, {base64_pdf}" width = "100%" height = "600" type:"application/pdf"</iframe>'
-    st.markdown(pdf_display, unsafe_allow_html=True)
-
 def handle_sidebar():
     docs_collection = st.file_uploader("Upload your documents here", accept_multiple_files=True, type=["pdf", "docx", "txt", "md"])
 
@@ -63,20 +79,10 @@ def handle_sidebar():
 
     return docs_collection, valid_docs
 
-def start_new_chat():
-    save_history(st.session_state.messages, name="old_chat_history")
-    st.session_state.messages = []
-    st.session_state.rawtext = []
-
-def show_notification(message, type='info'):
-    notification_placeholder = st.empty()
-    notification_placeholder.markdown(f'<div style="position: fixed; top: 30px; right: 30px; padding: 0.5rem 1rem; margin: 20; background-color: {"#f63366" if type == "error" else "#00A36C"}; color: white; font-weight: bold; border-radius: 5px; box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1); z-index: 999;">{message}</div>', unsafe_allow_html=True)
-    time.sleep(0.5)
-    notification_placeholder.empty()
-
 def main():
     st.title("PDFs Chatbot Interface :books:")
     st.markdown("This is a chatbot interface that allows you to upload PDFs and ask questions about them.")
+    warm_up_models()
     
     if "messages" not in st.session_state:
         st.session_state.messages = load_history()
@@ -84,25 +90,32 @@ def main():
     if "rawtext" not in st.session_state:
         st.session_state.rawtext = []
 
+    if "index" not in st.session_state:
+        st.session_state.index = None
+
+    if "docstore" not in st.session_state:
+        st.session_state.docstore = DocumentStore()
+
+    if "process_job" not in st.session_state:
+        st.session_state.process_job = None
+
     if "recording" not in st.session_state:
         st.session_state.recording = False
 
-    documentExist = 0
+    documentExist = 1 if len(st.session_state.docstore) else 0
     with st.sidebar:
         st.subheader("Your documents")
         docs_collection, valid_docs = handle_sidebar()
     
-        if valid_docs and st.button("Process", use_container_width=True):
-            with st.spinner("Processing..."):
-                st.session_state.rawtext = pp.preprocess_document(docs_collection)
-                for file in valid_docs:
-                    file.seek(0)  # Reset file pointer after processing
-                    documentExist = 1
-            show_notification("Documents processed successfully!")
+        if valid_docs and st.button("Process", use_container_width=True, disabled=bool(st.session_state.process_job)):
+            job = jobs.queue.submit("process", process_job, st.session_state.docstore, list(docs_collection))
+            st.session_state.process_job = job.id
+
+        if st.session_state.process_job:
+            processing_status()
             
         if st.button("Delete Chat History", use_container_width=True):
-            st.session_state.messages = []
-            save_history([])
+            delete_history()
             show_notification("Chat history has been deleted.")
             
         if st.button("Start New Chat", use_container_width=True):
@@ -110,8 +123,10 @@ def main():
             show_notification("New chat started. Old chat history stored!", type='success')
         
         if st.button("Show Old Chat History", use_container_width=True):
-            st.session_state.messages = load_history(name="old_chat_history")
-            show_notification("Old chat history restored!", type='success')
+            if restore_history():
+                show_notification("Old chat history restored!", type='success')
+            else:
+                show_notification("No old chat history to restore.", type='error')
 
     col1, col2 = st.columns([1, 1])
     
@@ -134,6 +149,9 @@ def main():
         # Create a div to wrap the chat messages
         st.markdown('<div class="chat-messages">', unsafe_allow_html=True)
 
+        if st.session_state.get("history_before") and st.button("Load earlier messages"):
+            load_earlier_history()
+
         # Display chat messages
         for message in st.session_state.messages:
             avatar = USER_AVATAR if message["role"] == "user" else BOT_AVATAR
@@ -152,21 +170,28 @@ def main():
         response = None
 
         if prompt:
-            with st.chat_message("assistant", avatar=BOT_AVATAR):
-                with st.spinner("Thinking..."):
-                    if st.session_state.rawtext:
-                        response, mode = md.model(prompt, st.session_state.rawtext)
-                        if mode == 'summarizer':
-                            response = ' '.join([sentence['summary_text'] for sentence in response])
+            with metrics.trace('chat') as trace, st.chat_message("assistant", avatar=BOT_AVATAR):
+                if st.session_state.rawtext and md.route(prompt) == 'summarizer':
+                    response = stream_summary(md.T5_stream(st.session_state.rawtext, st.session_state.index))
+                    response = pp.post_process(response) if response.strip() else NO_ANSWER
+                    st.markdown(response)
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                else:
+                    with st.spinner("Thinking..."):
+                        if st.session_state.rawtext:
+                            response, mode = md.model(prompt, st.session_state.rawtext, st.session_state.index)
+                            if mode in md.SUMMARY_MODES:
+                                response = ' '.join([sentence['summary_text'] for sentence in response])
+                            else:
+                                response = response['answer']
+                            response = pp.post_process(response) if response.strip() else NO_ANSWER
+                            st.markdown(response)
+                            st.session_state.messages.append({"role": "assistant", "content": response})
                         else:
-                            response = response['answer']
-                        response = pp.post_process(response)
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                    else:
-                        response = "Please upload PDFs before asking questions!"
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
+                            response = "Please upload PDFs before asking questions!"
+                            st.markdown(response)
+                            st.session_state.messages.append({"role": "assistant", "content": response})
+            st.session_state.last_trace = trace
 
         if st.session_state.messages == []:
             with st.chat_message("assistant", avatar=BOT_AVATAR):
@@ -177,6 +202,8 @@ def main():
         st.markdown('</div>', unsafe_allow_html=True)  # Close the chat input div
 
         if prompt := st.button("Start Speech Recognition"):
+            import speech_recognition as sr
+
             st.session_state.recording = True
             recognizer = sr.Recognizer()
             with sr.Microphone() as source:
@@ -190,8 +217,8 @@ def main():
                     st.markdown(user_input)
 
                 if st.session_state.rawtext:
-                    response, mode = md.model(user_input, st.session_state.rawtext)
-                    if mode == 'summarizer':
+                    response, mode = md.model(user_input, st.session_state.rawtext, st.session_state.index)
+                    if mode in md.SUMMARY_MODES:
                         response = ' '.join([sentence['summary_text'] for sentence in response])
                     else:
                         response = response['answer']
@@ -216,5 +243,9 @@ def main():
 
         save_history(st.session_state.messages)
 
+    # Drawn last so it already shows the request handled in this run
+    with st.sidebar:
+        debug_panel()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,24 +1,16 @@
-import speech_recognition as sr
 import preprocess as pp
 import streamlit as st
 import model as md
-import shelve
-import time
-import ner
+from docstore import DocumentStore, process_job
+import jobs
+import metrics
+from chat_ui import (NO_ANSWER, load_history, load_earlier_history, save_history, delete_history, archive_history,
+                     restore_history, start_new_chat, processing_status, debug_panel, stream_summary,
+                     warm_up_models, show_notification)
 
 USER_AVATAR = "👤"
 BOT_AVATAR = "🤖"
 
-# Load chat history from shelve file
-def load_history(name="chat_history"):
-    with shelve.open(name) as db:
-        return db.get("messages", [])
-
-# Save chat history to shelve file
-def save_history(messages, name="chat_history"):
-    with shelve.open(name) as db:
-        db["messages"] = messages
-
 def handle_sidebar():
     docs_collection = st.file_uploader("Upload your documents here", accept_multiple_files=True, type=["pdf", "docx", "txt", "md", "jpeg", "jpg", "png"])
 
@@ -37,23 +29,11 @@ def handle_sidebar():
 
     return docs_collection, valid_docs
 
-def start_new_chat():
-    # Save current chat history
-    save_history(st.session_state.messages, name="old_chat_history")
-    # Clear current chat history
-    st.session_state.messages = []
-    st.session_state.rawtext = []
-
-def show_notification(message, type='info'):
-    notification_placeholder = st.empty()
-    notification_placeholder.markdown(f'<div style="position: fixed; top: 30px; right: 30px; padding: 0.5rem 1rem; margin: 20; background-color: {"#f63366" if type == "error" else "#00A36C"}; color: white; font-weight: bold; border-radius: 5px; box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1); z-index: 999;">{message}</div>', unsafe_allow_html=True)
-    time.sleep(0.5)
-    notification_placeholder.empty()
-
 def main():
     st.set_page_config(page_title="Chat with multiple PDFs", page_icon=":books:")
     st.title("PDFs Chatbot Interface :books:")
     st.markdown("This is a chatbot interface that allows you to upload PDFs and ask questions about them.")
+    warm_up_models()
     
     # Initialize or load chat history
     if "messages" not in st.session_state:
@@ -62,6 +42,15 @@ def main():
     # Initialize or load chat history
     if "rawtext" not in st.session_state:
         st.session_state.rawtext = []
+
+    if "index" not in st.session_state:
+        st.session_state.index = None
+
+    if "docstore" not in st.session_state:
+        st.session_state.docstore = DocumentStore()
+
+    if "process_job" not in st.session_state:
+        st.session_state.process_job = None
         
     # Initialize recording state
     if "recording" not in st.session_state:
@@ -74,15 +63,21 @@ def main():
     
         # Display uploaded files' button
         if valid_docs:
-            if st.button("Process", use_container_width=True):
-                with st.spinner("Processing..."):
-                    st.session_state.rawtext = pp.preprocess_document(docs_collection)                    
-                show_notification("Documents processed successfully!")
-                ner.ner_main(st.session_state.rawtext)
+            if st.button("Process", use_container_width=True, disabled=bool(st.session_state.process_job)):
+                job = jobs.queue.submit("process", process_job, st.session_state.docstore, list(docs_collection))
+                st.session_state.process_job = job.id
+
+        if st.session_state.process_job:
+            processing_status()
+
+        # Once after every finished Process, like before the job queue
+        if st.session_state.pop("documents_processed", False):
+            import ner
+
+            ner.ner_main(str(st.session_state.rawtext))
     
         if st.button("Delete Chat History", use_container_width=True):
-            st.session_state.messages = []
-            save_history([])
+            delete_history()
             show_notification("Chat history has been deleted.")
             
         if st.button("Start New Chat", use_container_width=True):
@@ -90,9 +85,13 @@ def main():
             show_notification("New chat started. Old chat history stored!", type='success')
         
         if st.button("Show Old Chat History", use_container_width=True):
-            show_notification("Old chat history restored!", type='success')
-            st.session_state.messages = load_history(name="old_chat_history")
+            if restore_history():
+                show_notification("Old chat history restored!", type='success')
+            else:
+                show_notification("No old chat history to restore.", type='error')
     
+    if st.session_state.get("history_before") and st.button("Load earlier messages"):
+        load_earlier_history()
 
     # Display chat messages
     for message in st.session_state.messages:
@@ -110,24 +109,30 @@ def main():
 
     # Process user input and display using the bot
     if prompt:
-        with st.chat_message("assistant", avatar=BOT_AVATAR):
-            with st.spinner("Thinking..."):
-                if prompt and st.session_state.rawtext:  
-                    # This is the part where the model is called
-                    response, mode = md.model(prompt, st.session_state.rawtext)
-
-                    if mode == 'summarizer':
-                        response = [sentence['summary_text'] for sentence in response]
-                        response = ' '.join(response)
-                    else:
-                        response = response['answer']
-                    
-                    response = pp.post_process(response)
-                    st.markdown(response)
-                elif prompt and not st.session_state.rawtext:
-                    response = "Please upload PDFs before asking questions!!"
-                    st.markdown(response)
+        with metrics.trace('chat') as trace, st.chat_message("assistant", avatar=BOT_AVATAR):
+            if st.session_state.rawtext and md.route(prompt) == 'summarizer':
+                response = stream_summary(md.T5_stream(st.session_state.rawtext, st.session_state.index))
+                response = pp.post_process(response) if response.strip() else NO_ANSWER
+                st.markdown(response)
+            else:
+                with st.spinner("Thinking..."):
+                    if prompt and st.session_state.rawtext:  
+                        # This is the part where the model is called
+                        response, mode = md.model(prompt, st.session_state.rawtext, st.session_state.index)
+
+                        if mode in md.SUMMARY_MODES:
+                            response = [sentence['summary_text'] for sentence in response]
+                            response = ' '.join(response)
+                        else:
+                            response = response['answer']
                     
+                        response = pp.post_process(response) if response.strip() else NO_ANSWER
+                        st.markdown(response)
+                    elif prompt and not st.session_state.rawtext:
+                        response = "Please upload PDFs before asking questions!!"
+                        st.markdown(response)
+        st.session_state.last_trace = trace
+
     elif not st.session_state.messages:
          with st.chat_message("assistant", avatar=BOT_AVATAR):
             response = "Hello! I am here to help you with your questions."
@@ -138,6 +143,8 @@ def main():
 
     # Start Speech Recognition button
     if st.button("Start Speech Recognition"):
+        import speech_recognition as sr
+
         st.session_state.recording = True
         recognizer = sr.Recognizer()
         mic = sr.Microphone()
@@ -158,8 +165,8 @@ def main():
                 with st.chat_message("assistant", avatar=BOT_AVATAR):
                     with st.spinner("Thinking..."):
                         if user_input and st.session_state.rawtext:  # Check if context is not empty
-                            response, mode = md.model(user_input, st.session_state.rawtext)
-                            if mode == 'summarizer':
+                            response, mode = md.model(user_input, st.session_state.rawtext, st.session_state.index)
+                            if mode in md.SUMMARY_MODES:
                                 response = [sentence['summary_text'] for sentence in response]
                                 response = ' '.join(response)
                             else:
@@ -194,5 +201,9 @@ def main():
     # Save chat history after each interaction
     save_history(st.session_state.messages)
 
+    # Drawn last so it already shows the request handled in this run
+    with st.sidebar:
+        debug_panel()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from registry import MODEL_SPECS
+
+# eager: PyTorch fp32 as downloaded
+# int8:  PyTorch dynamic int8 quantization of the Linear layers
+# onnx:  ONNX Runtime export (needs `pip install optimum[onnxruntime]`)
+BACKENDS = ('eager', 'int8', 'onnx')
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'eager')
+
+# Exported and quantized models are built once and reused from here
+BACKEND_CACHE_DIR = os.environ.get('BACKEND_CACHE_DIR', '.model_cache')
+
+ORT_CLASSES = {
+    'question-answering': 'ORTModelForQuestionAnswering',
+    'summarization': 'ORTModelForSeq2SeqLM',
+    'ner': 'ORTModelForTokenClassification',
+}
+
+def artifact_path(name, backend):
+    checkpoint = MODEL_SPECS[name][3]
+    return os.path.join(BACKEND_CACHE_DIR, backend, checkpoint.replace('/', '--'))
+
+def load_tokenizer(name):
+    import transformers
+
+    _, tokenizer_cls, _, checkpoint = MODEL_SPECS[name]
+    return getattr(transformers, tokenizer_cls).from_pretrained(checkpoint)
+
+def load_eager(name):
+    import transformers
+
+    model_cls, checkpoint = MODEL_SPECS[name][2], MODEL_SPECS[name][3]
+    return getattr(transformers, model_cls).from_pretrained(checkpoint)
+
+def load_int8(name):
+    import torch
+
+    path = os.path.join(artifact_path(name, 'int8'), 'model.pt')
+    if os.path.exists(path):
+        return torch.load(path, weights_only=False)
+
+    model = load_eager(name)
+    model.eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(model, path)
+    return model
+
+def load_onnx(name):
+    try:
+        import optimum.onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The onnx backend needs optimum with ONNX Runtime: pip install optimum[onnxruntime]") from e
+
+    task, checkpoint = MODEL_SPECS[name][0], MODEL_SPECS[name][3]
+    ort_cls = getattr(ort, ORT_CLASSES[task])
+    path = artifact_path(name, 'onnx')
+    if onnx_exported(path):
+        return ort_cls.from_pretrained(path)
+
+    model = ort_cls.from_pretrained(checkpoint, export=True)
+    # Saved next to its final place and renamed once complete, so an interrupted
+    # export is never taken for a finished one
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=parent)
+    try:
+        model.save_pretrained(tmp)
+        if os.path.isdir(path):
+            shutil.rmtree(path)  # left by an export that did not finish
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Another process may have finished the same export first
+        if not onnx_exported(path):
+            raise
+    return model
+
+def onnx_exported(path):
+    return os.path.isdir(path) and any(f.endswith('.onnx') for f in os.listdir(path))
+
+LOADERS = {
+    'eager': load_eager,
+    'int8': load_int8,
+    'onnx': load_onnx,
+}
+
+def load_pipeline(name, backend=None):
+    from transformers import pipeline
+
+    backend = backend or INFERENCE_BACKEND
+    if backend not in LOADERS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    model = LOADERS[backend](name)
+    return pipeline(MODEL_SPECS[name][0], model=model, tokenizer=load_tokenizer(name))
+
+## One-time build step: export / quantize the models so the server only loads them
+def build(names, backend):
+    for name in names:
+        if backend != 'eager':
+            LOADERS[backend](name)
+        print(f"{name}: {backend} ready in {artifact_path(name, backend)}")
+
+if __name__ == '__main__':
+    # python backends.py onnx roberta T5
+    if len(sys.argv) < 2 or sys.argv[1] not in BACKENDS:
+        sys.exit(f"usage: python backends.py {{{'|'.join(BACKENDS)}}} [model ...]")
+    build(sys.argv[2:] or ['roberta', 'T5'], sys.argv[1])
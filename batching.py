@@ -0,0 +1,65 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+## Groups requests arriving from many threads into one call of
+## run_batch(items) -> results. A batch is sent when it holds max_batch items
+## or when max_wait seconds have passed since its first item arrived.
+class MicroBatcher:
+
+    def __init__(self, run_batch, max_batch=16, max_wait=0.02, name='batcher'):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = list(self.run_batch(items))
+                # A short result list would leave the last callers waiting forever
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch of {len(items)} items returned {len(results)} results")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch': round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,91 @@
+# Accuracy versus latency of the inference backends on a small local set.
+# Run from the project root: python benchmarks/backends.py [eager int8 onnx]
+from collections import Counter
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends
+
+QA_SET = [
+    ("The Eiffel Tower was completed in 1889 for the World's Fair in Paris. It is 330 metres tall and was designed by the company of Gustave Eiffel.",
+     "When was the Eiffel Tower completed?", "1889"),
+    ("The Eiffel Tower was completed in 1889 for the World's Fair in Paris. It is 330 metres tall and was designed by the company of Gustave Eiffel.",
+     "How tall is the Eiffel Tower?", "330 metres"),
+    ("Photosynthesis takes place in the chloroplasts of plant cells. Light energy is used to turn carbon dioxide and water into glucose and oxygen.",
+     "Where does photosynthesis take place?", "chloroplasts"),
+    ("The contract starts on 1 March 2024 and runs for two years. Either party may end it with ninety days written notice.",
+     "How long does the contract run?", "two years"),
+    ("The contract starts on 1 March 2024 and runs for two years. Either party may end it with ninety days written notice.",
+     "How much notice is needed to end the contract?", "ninety days"),
+    ("Python was created by Guido van Rossum and first released in 1991. Its design emphasises code readability.",
+     "Who created Python?", "Guido van Rossum"),
+]
+
+SUMMARY_SET = [
+    ("The city council met on Tuesday to discuss the new budget. After a long debate, members voted to increase spending on "
+     "public transport and road repairs, while cutting the budget for new office buildings. The mayor said the changes "
+     "would make the city easier to travel around and promised that taxes would not rise this year. Several residents "
+     "spoke at the meeting, most of them in favour of more buses and safer cycle lanes.",
+     "The council voted to spend more on public transport and road repairs and less on offices, without raising taxes."),
+    ("Researchers tested a new battery design that stores twice as much energy as current lithium-ion cells. The battery "
+     "uses a solid electrolyte, which makes it less likely to catch fire. In laboratory tests it kept ninety percent of "
+     "its capacity after one thousand charging cycles. The team hopes to build a larger prototype for electric cars "
+     "within three years, although manufacturing costs are still high.",
+     "A new solid electrolyte battery stores twice the energy, is safer and lasts long, but is still expensive to make."),
+]
+
+def words(text):
+    return re.findall(r"\w+", text.lower())
+
+def f1(prediction, reference):
+    pred, ref = Counter(words(prediction)), Counter(words(reference))
+    common = sum((pred & ref).values())
+    if not common:
+        return 0.0
+    precision, recall = common / sum(pred.values()), common / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - start
+
+def run_qa(backend):
+    nlp, load = timed(lambda: backends.load_pipeline('roberta', backend))
+    nlp(question=QA_SET[0][1], context=QA_SET[0][0])  # warm-up
+    latencies, exact, scores = [], 0, []
+    for context, question, gold in QA_SET:
+        res, t = timed(lambda: nlp(question=question, context=context))
+        latencies.append(t)
+        exact += words(res['answer']) == words(gold)
+        scores.append(f1(res['answer'], gold))
+    return load, sum(latencies) / len(latencies), exact / len(QA_SET), sum(scores) / len(scores)
+
+def run_summary(backend):
+    nlp, load = timed(lambda: backends.load_pipeline('T5', backend))
+    nlp(SUMMARY_SET[0][0], max_length=60, min_length=10, do_sample=False)  # warm-up
+    latencies, scores = [], []
+    for text, reference in SUMMARY_SET:
+        res, t = timed(lambda: nlp(text, max_length=60, min_length=10, do_sample=False))
+        latencies.append(t)
+        scores.append(f1(res[0]['summary_text'], reference))
+    return load, sum(latencies) / len(latencies), sum(scores) / len(scores)
+
+def main(names):
+    print(f"{'backend':>8} {'QA load s':>10} {'QA ms':>8} {'EM':>6} {'F1':>6} {'sum load s':>11} {'sum ms':>8} {'ROUGE-1':>8}")
+    for backend in names:
+        try:
+            qa_load, qa_t, em, qa_f1 = run_qa(backend)
+            sum_load, sum_t, rouge = run_summary(backend)
+        except ImportError as e:
+            # The onnx backend needs the optional optimum package
+            print(f"{backend:>8} skipped: {e}")
+            continue
+        print(f"{backend:>8} {qa_load:10.2f} {qa_t * 1000:8.1f} {em:6.2f} {qa_f1:6.2f} {sum_load:11.2f} {sum_t * 1000:8.1f} {rouge:8.2f}")
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or list(backends.BACKENDS))
@@ -0,0 +1,90 @@
+# Throughput and token agreement of the fast cleaning path against the original
+# NLTK path, on report-like sentences with quotes, abbreviations, contractions,
+# numbers and URLs, or on your own text files.
+# Run from the project root (needs the NLTK punkt and stopwords data):
+#   python benchmarks/clean_text.py [--sizes 0.5 2] [--files report.txt ...] [--show 10]
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import preprocess as pp
+
+SENTENCES = [
+    'The committee, chaired by Dr. Alvarez, met on 12 March to review the draft.',
+    'Mr. Chen said the results "were better than expected" but didn\'t give any numbers.',
+    'Revenue in the U.S. grew 3.5% to $10,000,000, while costs fell by roughly a third.',
+    'The report (see https://example.com/annual-report.pdf for the full text) covers 2019-2023.',
+    'It\'s a state-of-the-art system; they\'ll compare it with the baseline at 10:30 tomorrow.',
+    'We cannot confirm whether Acme Corp. will sign, e.g. because of the pending audit.',
+    '"Our customers come first," the chief executive wrote in a letter to shareholders.',
+    'Prof. Okafor\'s team e-mailed the survey to 2,400 students -- about half answered.',
+    'The model reads every page of the document... and it doesn\'t skip tables or footnotes.',
+    'Sales teams in Europe, Asia and the Middle East reported mixed results (see Fig. 4).',
+    'According to the auditors, i.e. the external firm, the accounts are complete.',
+    'Ms. Rossi asked: "What happens if the supplier doesn\'t deliver on time?"',
+    'I\'m not sure we\'re gonna finish before the deadline, so we\'ve asked for an extension.',
+    'The new policy applies to all employees of the company and its subsidiaries.',
+    'Ms. O\'Neil\'s C++ tool logged -5 degrees and winds of 10.5km/h, a 50/50 split for 24/7 use.',
+]
+
+def report_text(size_mb, seed=0):
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    paragraphs, size = [], 0
+    while size < target:
+        paragraph = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 8)))
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 1
+    return "\n".join(paragraphs)
+
+def timed(fn, text):
+    start = time.perf_counter()
+    out = fn(text)
+    return out, time.perf_counter() - start
+
+def reference_tokens(reference):
+    # URLs are dropped whole by the fast path while the old path left ": //host/..." behind
+    tokens = reference.split()
+    return [t for i, t in enumerate(tokens)
+            if not t.startswith('//') and not (t == ':' and tokens[i + 1:i + 2] and tokens[i + 1].startswith('//'))]
+
+## Share of the reference tokens the fast path reproduces, in order, and the
+## first differing (reference, fast) runs
+def agreement(reference, fast, show=0):
+    ref, fast = reference_tokens(reference), fast.split()
+    matcher = difflib.SequenceMatcher(None, ref, fast, autojunk=False)
+    same = sum(block.size for block in matcher.get_matching_blocks())
+    diffs = [(" ".join(ref[i1:i2]), " ".join(fast[j1:j2]))
+             for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal'][:show]
+    return same / max(len(ref), len(fast), 1), diffs
+
+def run(label, text, show):
+    mb = len(text) / (1024 * 1024)
+    reference, t_nltk = timed(pp.preprocess_text_nltk, text)
+    fast, t_fast = timed(pp.clean_text, text)
+    score, diffs = agreement(reference, fast, show)
+    print(f"{label:<24} {mb:8.2f} {mb / t_nltk:10.2f} {mb / t_fast:10.2f} {t_nltk / t_fast:7.1f}x {score:10.2%}")
+    for ref, new in diffs:
+        print(f"    nltk: {ref!r:<40} fast: {new!r}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the fast text cleaning with the NLTK path")
+    parser.add_argument('--sizes', nargs='*', type=float, default=[0.5, 2.0], help="MB of report-like text")
+    parser.add_argument('--files', nargs='*', default=[], help="text files to clean as well")
+    parser.add_argument('--show', type=int, default=5, help="token differences listed per input")
+    args = parser.parse_args(argv)
+
+    print(f"{'input':<24} {'size MB':>8} {'nltk MB/s':>10} {'fast MB/s':>10} {'speedup':>8} {'agreement':>10}")
+    for size_mb in args.sizes:
+        run(f"report text {size_mb:g} MB", report_text(size_mb), args.show)
+    for path in args.files:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            run(os.path.basename(path)[:24], f.read(), args.show)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# Import time of the modules the apps load before the first page renders, and
+# of the heavy dependencies they only import on the code path that needs them.
+# Run from the project root:
+#   python benchmarks/imports.py [--modules preprocess model ...] [--render] [--check]
+#                                [--out results.json] [--compare old.json]
+# Every measurement runs in a fresh interpreter with `python -X importtime`,
+# so nothing is already in sys.modules. --check exits with 1 when one of the
+# HEAVY packages is imported at startup.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipeline import git_commit
+
+# What app.py imports at the top, streamlit included
+STARTUP_MODULES = ['streamlit', 'preprocess', 'model', 'docstore', 'jobs', 'metrics', 'history', 'doc_cache']
+
+# Only imported when a file of that type is processed, a model is loaded or a
+# button is pressed
+HEAVY = ['transformers', 'torch', 'nltk', 'langchain', 'PyPDF2', 'docx', 'markdown', 'ocr', 'fitz',
+         'speech_recognition', 'optimum']
+
+## [(package, self seconds, cumulative seconds, depth)] from the -X importtime lines
+def parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return rows
+
+## Import the modules in a fresh interpreter, returns its import rows, wall
+## seconds and the HEAVY packages that ended up in sys.modules
+def profile(modules, env=None):
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            + "".join(f"import {m}\n" for m in modules)
+            + "seconds = time.perf_counter() - start\n"
+            f"heavy = sorted(m for m in {HEAVY!r} if m in sys.modules)\n"
+            "print(json.dumps({'seconds': seconds, 'heavy': heavy}))\n")
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True, text=True,
+                          env={**os.environ, **(env or {})})
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['rows'] = parse_importtime(proc.stderr)
+    return result
+
+## Median of repeat runs, with the per package times of the median run
+def measure(modules, repeat):
+    runs = [profile(modules) for _ in range(repeat)]
+    if 'error' in runs[0]:
+        return runs[0]
+    runs.sort(key=lambda r: r['seconds'])
+    run = runs[len(runs) // 2]
+    # Top level packages only: their cumulative time includes everything below
+    packages = {}
+    for name, _, cumulative, depth in run['rows']:
+        if depth == 0:
+            top = name.split('.')[0]
+            packages[top] = packages.get(top, 0.0) + cumulative
+    return {
+        'seconds': run['seconds'],
+        'min_seconds': runs[0]['seconds'],
+        'heavy': run['heavy'],
+        'modules': len(run['rows']),
+        'packages': dict(sorted(packages.items(), key=lambda kv: -kv[1])),
+    }
+
+## First run of the app script with Streamlit's test runner, in a fresh
+## interpreter, no models warmed up
+def first_render(script, repeat):
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            "from streamlit.testing.v1 import AppTest\n"
+            f"at = AppTest.from_file({script!r}, default_timeout=120)\n"
+            "at.run()\n"
+            "seconds = time.perf_counter() - start\n"
+            f"heavy = sorted(m for m in {HEAVY!r} if m in sys.modules)\n"
+            "print(json.dumps({'seconds': seconds, 'heavy': heavy, 'errors': [str(e.value) for e in at.exception]}))\n")
+    seconds, result = [], None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                              env={**os.environ, 'WARMUP_MODELS': ''})
+        if proc.returncode != 0:
+            return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        seconds.append(result['seconds'])
+    result['seconds'] = statistics.median(seconds)
+    return result
+
+## {"group/name": seconds} of a results file
+def flatten(report):
+    rows = {}
+    for group in ('startup', 'render'):
+        for name, result in report.get(group, {}).items():
+            if 'seconds' in result:
+                rows[f"{group}/{name}"] = result['seconds']
+    for name, result in report.get('deferred', {}).items():
+        if 'seconds' in result:
+            rows[f"deferred/{name}"] = result['seconds']
+    return rows
+
+def compare(old, new):
+    old = flatten(old)
+    print(f"\n{'import':<58} {'old s':>9} {'new s':>9} {'change':>8}")
+    for key, seconds in sorted(flatten(new).items()):
+        if old.get(key):
+            print(f"{key:<58} {old[key]:9.4f} {seconds:9.4f} {seconds / old[key] - 1:+8.1%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile import and first render time of the apps")
+    parser.add_argument('--modules', nargs='+', default=STARTUP_MODULES, help="modules imported at startup")
+    parser.add_argument('--deferred', nargs='*', default=HEAVY, help="heavy packages to time on their own")
+    parser.add_argument('--render', nargs='*', default=None, metavar='SCRIPT',
+                        help="also time the first run of these app scripts (default app.py), needs streamlit")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15, help="packages listed in the startup breakdown")
+    parser.add_argument('--check', action='store_true', help="fail when a HEAVY package is imported at startup")
+    parser.add_argument('--out')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'startup': {},
+        'deferred': {},
+    }
+
+    startup = measure(args.modules, args.repeat)
+    report['startup']['all'] = startup
+    if 'error' in startup:
+        print(f"startup imports failed: {startup['error']}")
+    else:
+        print(f"startup imports ({', '.join(args.modules)}): {startup['seconds']:.3f} s, {startup['modules']} modules")
+        print(f"\n{'package':<32} {'cumulative s':>12}")
+        for package, seconds in list(startup['packages'].items())[:args.top]:
+            print(f"{package:<32} {seconds:12.4f}")
+        print(f"\nheavy packages imported at startup: {', '.join(startup['heavy']) or 'none'}")
+        # Each startup module on its own, to see what pulls a slow package in
+        for module in args.modules:
+            report['startup'][module] = {k: v for k, v in measure([module], 1).items() if k != 'packages'}
+
+    print(f"\n{'deferred package':<32} {'import s':>12}")
+    for package in args.deferred:
+        result = measure([package], args.repeat)
+        report['deferred'][package] = {k: v for k, v in result.items() if k != 'packages'}
+        print(f"{package:<32} {result['seconds']:12.4f}" if 'seconds' in result else f"{package:<32} {'not installed':>12}")
+
+    if args.render is not None:
+        report['render'] = {}
+        for script in args.render or ['app.py']:
+            result = first_render(script, args.repeat)
+            report['render'][script] = result
+            if 'error' in result:
+                print(f"\nfirst render of {script} failed: {result['error']}")
+            else:
+                print(f"\nfirst render of {script}: {result['seconds']:.3f} s, heavy packages: {', '.join(result['heavy']) or 'none'}")
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', 'imports-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+    if args.check and startup.get('heavy'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
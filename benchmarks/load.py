@@ -0,0 +1,401 @@
+# Concurrent sessions against one process, the way a replica of app.py serves
+# them: every simulated session uploads documents, runs Process through the
+# job queue and asks questions and a summary, with the chat history saved
+# after every answer. Latency percentiles, throughput and memory are reported
+# per session count. Run from the project root:
+#   python benchmarks/load.py [--sessions 1 4 16 32] [--questions 3] [--think 0.5]
+#                             [--model stub|real] [--latency 0.05] [--latency-per-item 0.01]
+#                             [--out results.json] [--compare old.json]
+# With --model stub (default) no checkpoint is downloaded: the reader, the
+# summarizer and their tokenizers are replaced by stand-ins that sleep for the
+# configured latency, so the preprocessing, chunking, retrieval, caching and
+# history code runs for real while inference costs what you tell it to.
+# Summaries go through model.model() like a spoken question does, the chat's
+# streamed path needs a real generate().
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Caches, corpus and history of the run live in a scratch directory, set
+# before the project modules read their settings, so the real ones are never
+# read or cleared
+SCRATCH = tempfile.mkdtemp(prefix='chatbot-load-')
+for name, sub in (('DOC_CACHE_DIR', 'doc_cache'), ('CORPUS_DIR', 'corpus'), ('HISTORY_DB', 'history.db'),
+                  ('RESULT_CACHE_PATH', 'results.db')):
+    os.environ[name] = os.path.join(SCRATCH, sub)
+
+from pipeline import MAKERS, git_commit, synthetic_sentences
+
+import corpus
+import doc_cache
+import history
+import jobs
+import model as md
+import registry
+import result_cache
+from docstore import DocumentStore, process_job
+from extraction import NamedBytesIO
+
+QUESTIONS = [
+    "What did the team compare?",
+    "How many users were the results shared with?",
+    "When were the results shared?",
+    "How much did revenue grow?",
+    "What happened to costs after the new contract started?",
+    "What does the model read?",
+    "Which regions were compared?",
+]
+SUMMARY = "Summarize the documents"
+
+## Stand-ins for the checkpoints
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+## Splits into words and punctuation, about as many pieces as a subword tokenizer
+class StubTokenizer:
+    model_max_length = 512
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        extra = 2 if add_special_tokens else 0
+        if isinstance(texts, str):
+            return {'input_ids': list(range(len(WORD_RE.findall(texts)) + extra))}
+        return {'input_ids': [list(range(len(WORD_RE.findall(t)) + extra)) for t in texts]}
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 3 if pair else 2
+
+## A pipeline call costs latency plus latency_per_item for every input. Calls
+## share `device`, a semaphore of how many can run at once.
+class StubPipeline:
+
+    def __init__(self, task, latency, latency_per_item, device):
+        self.task = task
+        self.latency = latency
+        self.latency_per_item = latency_per_item
+        self.device = device
+        self.tokenizer = StubTokenizer()
+        self.model = None
+
+    def run(self, n):
+        with self.device:
+            time.sleep(self.latency + self.latency_per_item * n)
+
+    def __call__(self, inputs=None, question=None, context=None, **kwargs):
+        if self.task == 'summarization':
+            texts = [inputs] if isinstance(inputs, str) else list(inputs)
+            self.run(len(texts))
+            # Roughly the first sentence and a half
+            return [{'summary_text': t[:150]} for t in texts]
+        if self.task == 'ner':
+            texts = [inputs] if isinstance(inputs, str) else list(inputs)
+            self.run(len(texts))
+            return [[] for _ in texts]
+
+        if inputs is not None:
+            question, context = inputs['question'], inputs['context']
+        single = isinstance(question, str)
+        questions, contexts = ([question], [context]) if single else (question, context)
+        self.run(len(questions))
+        answers = [self.answer(q, c) for q, c in zip(questions, contexts)]
+        return answers[0] if single else answers
+
+    # The first word of the context that also is in the question
+    def answer(self, question, context):
+        words = {w.lower() for w in WORD_RE.findall(question) if len(w) > 3}
+        for m in re.finditer(r"\w+", context):
+            if m.group().lower() in words:
+                return {'score': 0.5, 'start': m.start(), 'end': m.end(), 'answer': m.group()}
+        return {'score': 0.0, 'start': 0, 'end': 0, 'answer': ''}
+
+def use_stub_models(latency, latency_per_item, concurrency):
+    device = threading.BoundedSemaphore(concurrency)
+    registry.registry.clear()
+    registry.registry.loader = lambda name: StubPipeline(registry.MODEL_SPECS[name][0], latency, latency_per_item, device)
+    registry.registry.sizer = lambda nlp: 0.0
+    tokenizer = StubTokenizer()
+    md.get_tokenizer = lambda name: tokenizer
+
+## Memory
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        # No /proc: the peak so far is the best there is
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        # Windows has no resource module
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+
+## Highest resident memory seen while running
+class MemorySampler(threading.Thread):
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, rss_mb())
+        return self.peak
+
+## Sessions
+
+def session_files(types, size_kb, seed):
+    sentences = synthetic_sentences(int(size_kb * 1024), seed=seed)
+    return [(f"report-{seed}.{file_type}", MAKERS[file_type](sentences)) for file_type in types]
+
+## One user: the steps app.py runs for them, each timed as the user sees it
+class Session:
+
+    def __init__(self, number, files, questions, think, history_store):
+        self.id = f"load-{number}-{os.getpid()}-{time.monotonic_ns()}"
+        self.files = files
+        self.questions = questions
+        self.think = think
+        self.history = history_store
+        self.rng = random.Random(number)
+        self.messages = []
+        self.saved = 0
+        self.uploads = []
+        self.store = None
+        self.timings = []  # (step, seconds)
+        self.errors = []
+
+    def step(self, name, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            self.errors.append(f"{name}: {type(e).__name__}: {e}")
+            return False
+        self.timings.append((name, time.perf_counter() - start))
+        return True
+
+    def pause(self):
+        if self.think:
+            time.sleep(self.think * self.rng.uniform(0.5, 1.5))
+
+    def open(self):
+        self.messages, _ = self.history.load_page(self.id, limit=50)
+        self.saved = len(self.messages)
+
+    def upload(self):
+        self.uploads = [NamedBytesIO(data, name) for name, data in self.files]
+
+    def process(self):
+        job = jobs.queue.submit("process", process_job, self.store or DocumentStore(), self.uploads)
+        # The app polls the job on every rerun
+        while job.running:
+            time.sleep(0.02)
+        if job.status != 'done':
+            raise RuntimeError(job.error or job.status)
+        self.store, _, _ = job.result
+
+    def ask(self, question):
+        res, mode = md.model(question, self.store.context(), self.store.index)
+        if res is None:
+            raise RuntimeError(f"{mode} failed")
+        answer = res[0]['summary_text'] if mode in md.SUMMARY_MODES else res['answer']
+        self.messages += [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+        self.history.append(self.id, self.messages[self.saved:])
+        self.saved = len(self.messages)
+
+    def run(self):
+        if not (self.step('open', self.open) and self.step('upload', self.upload) and self.step('process', self.process)):
+            return
+        for question in self.questions:
+            self.pause()
+            self.step('question', lambda: self.ask(question))
+        self.pause()
+        self.step('summarize', lambda: self.ask(SUMMARY))
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+def latency_stats(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+## Caches start empty for every session count unless warm is set
+def reset_caches(warm):
+    if warm:
+        return
+    result_cache.cache.clear()
+    doc_cache.cache.clear()
+    shutil.rmtree(corpus.CORPUS_DIR, ignore_errors=True)
+
+def run_level(n, args, history_store, level):
+    reset_caches(args.warm)
+    shared = session_files(args.types, args.doc_kb, seed=0) if args.same_docs else None
+    sessions = []
+    for i in range(n):
+        rng = random.Random(level * 100003 + i)
+        questions = [rng.choice(QUESTIONS) for _ in range(args.questions)]
+        files = shared or session_files(args.types, args.doc_kb, seed=level * 100003 + i + 1)
+        sessions.append(Session(i, files, questions, args.think, history_store))
+
+    baseline = rss_mb()
+    sampler = MemorySampler()
+    sampler.start()
+    threads = []
+    start = time.perf_counter()
+    for i, session in enumerate(sessions):
+        thread = threading.Thread(target=session.run, name=f"session-{i}")
+        thread.start()
+        threads.append(thread)
+        if args.ramp and n > 1:
+            time.sleep(args.ramp / (n - 1))
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    peak = sampler.stop()
+    # Documents are still referenced by the sessions, like session_state would
+    held = rss_mb()
+
+    steps = {}
+    for session in sessions:
+        for name, seconds in session.timings:
+            steps.setdefault(name, []).append(seconds)
+    interactions = [s for name in ('question', 'summarize') for s in steps.get(name, [])]
+    errors = [e for s in sessions for e in s.errors]
+    return {
+        'sessions': n,
+        'wall_seconds': wall,
+        'requests': sum(len(s.timings) for s in sessions),
+        'requests_per_s': sum(len(s.timings) for s in sessions) / wall if wall else None,
+        'answers_per_s': len(interactions) / wall if wall else None,
+        'latency': {'answers': latency_stats(interactions), **{name: latency_stats(v) for name, v in steps.items()}},
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'memory': {
+            'baseline_mb': round(baseline, 1),
+            'peak_mb': round(peak, 1),
+            'held_mb': round(held, 1),
+            'peak_per_session_mb': round((peak - baseline) / n, 2),
+            'held_per_session_mb': round((held - baseline) / n, 2),
+        },
+    }
+
+def fmt(seconds):
+    return f"{seconds:8.3f}" if seconds is not None else f"{'-':>8}"
+
+## {"sessions=N/step.pXX": seconds} of a results file
+def flatten(report):
+    rows = {}
+    for level in report.get('levels', []):
+        for step, stats in level['latency'].items():
+            for q in ('p50', 'p95'):
+                if stats[q] is not None:
+                    rows[f"sessions={level['sessions']}/{step}.{q}"] = stats[q]
+    return rows
+
+def compare(old, new):
+    old = flatten(old)
+    print(f"\n{'latency':<58} {'old s':>9} {'new s':>9} {'change':>8}")
+    for key, seconds in sorted(flatten(new).items()):
+        if old.get(key):
+            print(f"{key:<58} {old[key]:9.4f} {seconds:9.4f} {seconds / old[key] - 1:+8.1%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test concurrent chat sessions in one process")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 4, 16, 32], help="concurrent session counts to run")
+    parser.add_argument('--questions', type=int, default=3, help="questions per session, followed by one summary")
+    parser.add_argument('--think', type=float, default=0.5, help="mean seconds a user waits between steps")
+    parser.add_argument('--ramp', type=float, default=1.0, help="seconds over which the sessions start")
+    parser.add_argument('--types', nargs='+', default=['pdf', 'txt'], choices=list(MAKERS))
+    parser.add_argument('--doc-kb', type=float, default=200, help="KB of text per uploaded file")
+    parser.add_argument('--same-docs', action='store_true', help="every session uploads the same files")
+    parser.add_argument('--warm', action='store_true', help="keep caches and corpus between session counts")
+    parser.add_argument('--model', choices=['stub', 'real'], default='stub')
+    parser.add_argument('--latency', type=float, default=0.05, help="stub seconds per pipeline call")
+    parser.add_argument('--latency-per-item', type=float, default=0.01, help="stub seconds per input of a call")
+    parser.add_argument('--model-concurrency', type=int, default=1, help="stub calls that can run at the same time")
+    parser.add_argument('--slo', type=float, default=2.0, help="p95 answer latency (s) a session count must stay under")
+    parser.add_argument('--out')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    if args.model == 'stub':
+        use_stub_models(args.latency, args.latency_per_item, args.model_concurrency)
+    history_store = history.HistoryStore()
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+            'env': {k: v for k, v in os.environ.items()
+                    if k in ('EXTRACT_WORKERS', 'JOB_WORKERS', 'INFERENCE_BACKEND', 'QA_MODE', 'ROUTER',
+                             'MODEL_MEMORY_BUDGET_MB', 'SUMMARY_EXTRACT_TOKENS', 'DEDUP_THRESHOLD')},
+        },
+        'levels': [],
+    }
+
+    print(f"{'sessions':>8} {'req/s':>8} {'ans/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'process p95':>12} "
+          f"{'peak MB':>9} {'MB/sess':>8} {'errors':>7}")
+    try:
+        for level, n in enumerate(args.sessions):
+            result = run_level(n, args, history_store, level)
+            report['levels'].append(result)
+            answers, process = result['latency']['answers'], result['latency'].get('process', {})
+            print(f"{n:8d} {result['requests_per_s']:8.2f} {result['answers_per_s']:8.2f} {fmt(answers['p50'])} "
+                  f"{fmt(answers['p95'])} {fmt(answers['p99'])} {fmt(process.get('p95')):>12} "
+                  f"{result['memory']['peak_mb']:9.1f} {result['memory']['peak_per_session_mb']:8.2f} {result['errors']:7d}")
+            for error in result['error_samples']:
+                print(f"         {error}")
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    # Largest session count whose answers stayed within the target
+    within = [l['sessions'] for l in report['levels']
+              if l['latency']['answers']['p95'] is not None and l['latency']['answers']['p95'] <= args.slo and not l['errors']]
+    report['max_sessions_within_slo'] = max(within) if within else None
+    print(f"\nMost sessions with p95 answer latency <= {args.slo:g} s: {report['max_sessions_within_slo'] or 'none'}")
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', 'load-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
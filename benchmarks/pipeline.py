@@ -0,0 +1,330 @@
+# Throughput, peak memory and model latency of the Process and question steps.
+# Run from the project root:
+#   python benchmarks/pipeline.py [--sizes 0.1 1] [--types pdf docx txt md] [--fixtures DIR]
+#                                 [--no-models] [--no-tokenizers] [--out results.json] [--compare old.json]
+# Results are written as JSON (default benchmarks/results/<time>.json) so runs
+# before and after a change can be compared with --compare.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import doc_cache
+import preprocess as pp
+from extraction import NamedBytesIO
+
+WORDS = ("the report describes a model that reads each document and answers questions about its content "
+         "results were shared with 10,000 users in March while the team compared scores across three "
+         "regions revenue grew by 3.5 % and costs fell after the new contract started").split()
+
+QUESTION = "What did the team compare?"
+
+## Synthetic corpora
+
+def synthetic_sentences(size_bytes, seed=0):
+    rng = random.Random(seed)
+    sentences, size = [], 0
+    while size < size_bytes:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 24))]
+        sentence = " ".join(words).capitalize() + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return sentences
+
+def paragraphs(sentences, per_paragraph=6):
+    return [" ".join(sentences[i:i + per_paragraph]) for i in range(0, len(sentences), per_paragraph)]
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+## A plain PDF with one Helvetica text line per sentence, written by hand so
+## no PDF writer is needed to build the corpus
+def make_pdf(sentences, lines_per_page=45, chars_per_line=95):
+    lines = []
+    for sentence in sentences:
+        while len(sentence) > chars_per_line:
+            cut = sentence.rfind(" ", 0, chars_per_line)
+            cut = cut if cut > 0 else chars_per_line
+            lines.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        lines.append(sentence)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        ops = ["BT /F1 10 Tf 12 TL 50 800 Td"] + [f"({pdf_escape(line)}) '" for line in page] + ["ET"]
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+def make_docx(sentences):
+    from docx import Document
+
+    doc = Document()
+    for paragraph in paragraphs(sentences):
+        doc.add_paragraph(paragraph)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+def make_txt(sentences):
+    return "\n\n".join(paragraphs(sentences)).encode("utf-8")
+
+def make_md(sentences):
+    parts = []
+    for i, paragraph in enumerate(paragraphs(sentences)):
+        if i % 5 == 0:
+            parts.append(f"## Section {i // 5 + 1}")
+        parts.append(paragraph)
+    return "\n\n".join(parts).encode("utf-8")
+
+MAKERS = {'pdf': make_pdf, 'docx': make_docx, 'txt': make_txt, 'md': make_md}
+
+## (name, [(file name, bytes)]) per file type and size, sizes are MB of text
+def synthetic_corpora(sizes, types):
+    corpora = []
+    for size_mb in sizes:
+        sentences = synthetic_sentences(int(size_mb * 1024 * 1024))
+        for file_type in types:
+            corpora.append((f"synthetic-{file_type}-{size_mb:g}MB", [(f"doc.{file_type}", MAKERS[file_type](sentences))]))
+    return corpora
+
+## One corpus with every supported file found under the directory
+def fixture_corpus(directory):
+    files = []
+    for base, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.split(".")[-1].lower() in MAKERS:
+                with open(os.path.join(base, name), "rb") as f:
+                    files.append((name, f.read()))
+    return (f"fixtures-{os.path.basename(os.path.normpath(directory))}", files)
+
+## Measuring
+
+def measure(fn, repeat=1, memory=True):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - start)
+    result = {'seconds': statistics.median(times), 'min_seconds': min(times)}
+    if memory:
+        # Separate run, tracing slows the code down. Only allocations of this
+        # process are seen, not the extraction workers or native model tensors
+        tracemalloc.start()
+        fn()
+        result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    return out, result
+
+## Peak resident memory of this process in MB, None where it can't be read
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module, psutil reports the peak working set there
+        try:
+            import psutil
+        except ImportError:
+            return None
+        peak = getattr(psutil.Process().memory_info(), 'peak_wset', None)
+        return round(peak / 2**20, 1) if peak else None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def with_throughput(result, n_bytes):
+    result['mb_per_s'] = round(n_bytes / 2**20 / result['seconds'], 3) if result['seconds'] else None
+    return result
+
+def run_corpus(name, files, repeat, memory, tokenizers=True):
+    n_bytes = sum(len(data) for _, data in files)
+    results = {}
+
+    # Cold extraction starts from an empty document cache, warm reads it back
+    with tempfile.TemporaryDirectory() as cache_dir:
+        saved_cache = doc_cache.cache
+        doc_cache.cache = doc_cache.DiskCache(cache_dir)
+        try:
+            def extract():
+                return pp.get_text_from_files([NamedBytesIO(data, file_name) for file_name, data in files])
+
+            start = time.perf_counter()
+            text = extract()
+            results['get_text_from_files.cold'] = with_throughput({'seconds': time.perf_counter() - start}, n_bytes)
+            _, results['get_text_from_files.warm'] = measure(extract, repeat, memory)
+            with_throughput(results['get_text_from_files.warm'], n_bytes)
+        finally:
+            doc_cache.cache = saved_cache
+
+    text_bytes = len(text.encode("utf-8"))
+    cleaned, results['preprocess_text'] = measure(lambda: pp.preprocess_text(text), repeat, memory)
+    with_throughput(results['preprocess_text'], text_bytes)
+    cleaned_bytes = len(cleaned.encode("utf-8"))
+    chunks, results['get_text_chunks'] = measure(lambda: pp.get_text_chunks(cleaned), repeat, memory)
+    with_throughput(results['get_text_chunks'], cleaned_bytes)
+
+    info = {'files': len(files), 'bytes': n_bytes, 'text_bytes': text_bytes, 'chunks': len(chunks)}
+    if tokenizers:
+        info.update(run_token_chunking(cleaned, cleaned_bytes, results, repeat, memory))
+    return info, results, text
+
+## The chunkers the app uses: reader windows for question answering (what
+## Process indexes) and summary chunks for T5. Both tokenize the whole text.
+def run_token_chunking(cleaned, cleaned_bytes, results, repeat, memory):
+    import chunking
+    import model as md
+    from registry import get_tokenizer
+
+    # Loaded once per process in the app too, not part of the chunking time
+    t5_tokenizer = get_tokenizer('T5')
+    get_tokenizer('roberta')
+
+    reader, results['reader_chunks'] = measure(lambda: md.reader_chunks(cleaned), repeat, memory)
+    with_throughput(results['reader_chunks'], cleaned_bytes)
+    # Only the tokenizer is loaded, the prefix is the one in T5's config
+    reserve = chunking.prefix_tokens(t5_tokenizer, 'summarize: ')
+    summary, results['chunk_for_model.T5'] = measure(
+        lambda: chunking.chunk_for_model(cleaned, t5_tokenizer, reserve=reserve, overlap_tokens=0), repeat, memory)
+    with_throughput(results['chunk_for_model.T5'], cleaned_bytes)
+    return {'reader_chunks': len(reader), 'summary_chunks': len(summary)}
+
+## Cold is the first call after the models are unloaded (load included),
+## warm is the median of the calls after it
+def run_models(text, repeat):
+    import model as md
+    from registry import registry
+
+    context = text[:4000]
+    calls = {
+        'roberta': lambda: md.roberta(QUESTION, context),
+        'T5': lambda: md.T5(context),
+    }
+    results = {}
+    for name, call in calls.items():
+        registry.clear()
+        start = time.perf_counter()
+        call()
+        cold = time.perf_counter() - start
+        warm = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            warm.append(time.perf_counter() - start)
+        results[name] = {'cold_seconds': cold, 'warm_seconds': statistics.median(warm), 'warm_min_seconds': min(warm),
+                         'model_id': md.model_id(name)}
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(old, new):
+    old = flatten(old)
+    print(f"\n{'benchmark':<58} {'old s':>9} {'new s':>9} {'change':>8}")
+    for key, seconds in sorted(flatten(new).items()):
+        if old.get(key):
+            print(f"{key:<58} {old[key]:9.4f} {seconds:9.4f} {seconds / old[key] - 1:+8.1%}")
+
+## {"corpus/stage": seconds} of a results file
+def flatten(report):
+    rows = {}
+    for corpus, stages in report.get('results', {}).items():
+        for stage, result in stages.items():
+            rows[f"{corpus}/{stage}"] = result['seconds']
+    for name, result in report.get('models', {}).items():
+        rows[f"models/{name}.cold"] = result['cold_seconds']
+        rows[f"models/{name}.warm"] = result['warm_seconds']
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark document processing and model latency")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.1, 1.0], help="MB of text per synthetic file")
+    parser.add_argument('--types', nargs='+', default=list(MAKERS), choices=list(MAKERS))
+    parser.add_argument('--fixtures', nargs='*', default=[], help="directories of real documents, one corpus each")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced peak memory runs")
+    parser.add_argument('--no-models', action='store_true', help="skip the roberta and T5 latency runs")
+    parser.add_argument('--no-tokenizers', action='store_true',
+                        help="skip the reader and summary chunking, which need the model tokenizers")
+    parser.add_argument('--out')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    corpora = synthetic_corpora(args.sizes, args.types) + [fixture_corpus(d) for d in args.fixtures]
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'env': {k: v for k, v in os.environ.items()
+                    if k in ('EXTRACT_WORKERS', 'INFERENCE_BACKEND', 'QA_MODE', 'MODEL_MEMORY_BUDGET_MB')},
+        },
+        'corpora': {},
+        'results': {},
+    }
+
+    print(f"{'corpus':<28} {'stage':<28} {'seconds':>9} {'MB/s':>9} {'peak MB':>9}")
+    text = ""
+    for name, files in corpora:
+        if not files:
+            continue
+        info, results, corpus_text = run_corpus(name, files, args.repeat, not args.no_memory, not args.no_tokenizers)
+        report['corpora'][name] = info
+        report['results'][name] = results
+        text = text or corpus_text
+        for stage, r in results.items():
+            print(f"{name:<28} {stage:<28} {r['seconds']:9.4f} {r.get('mb_per_s') or 0:9.2f} {r.get('peak_mb', float('nan')):9.2f}")
+
+    if not args.no_models:
+        report['models'] = run_models(text or " ".join(synthetic_sentences(8000)), args.repeat)
+        for name, r in report['models'].items():
+            print(f"{'model ' + name:<28} {'cold / warm':<28} {r['cold_seconds']:9.3f} {r['warm_seconds']:9.3f}")
+
+    report['meta']['max_rss_mb'] = peak_rss_mb()
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
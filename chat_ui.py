@@ -0,0 +1,157 @@
+# Chat history, background job status and debug panel of the Streamlit apps,
+# shared by app.py and appp.py
+import time
+import uuid
+
+import streamlit as st
+
+from docstore import DocumentStore
+import history
+import jobs
+import model as md
+
+HISTORY_PAGE = 50
+
+# Shown instead of an empty answer, post_process needs some text
+NO_ANSWER = "Sorry, I could not find an answer to that in the documents."
+
+# Chat history is kept per browser session, the id rides in the URL so a reload keeps it
+def history_session():
+    if "history_session" not in st.session_state:
+        session = st.query_params.get("session")
+        if not session:
+            session = uuid.uuid4().hex
+            st.query_params["session"] = session
+        st.session_state.history_session = session
+    return st.session_state.history_session
+
+# Load the newest page of the chat history
+def load_history():
+    store = history.get_store()
+    store.import_shelve(history_session())
+    messages, first_id = store.load_page(history_session(), limit=HISTORY_PAGE)
+    st.session_state.history_saved = len(messages)
+    st.session_state.history_before = first_id if len(messages) == HISTORY_PAGE else None
+    return messages
+
+# Prepend the page of messages before the ones on screen
+def load_earlier_history():
+    older, first_id = history.get_store().load_page(history_session(), limit=HISTORY_PAGE, before=st.session_state.history_before)
+    st.session_state.messages[:0] = older
+    st.session_state.history_saved += len(older)
+    st.session_state.history_before = first_id if len(older) == HISTORY_PAGE else None
+
+# Only the messages added since the last save are written
+def save_history(messages):
+    saved = st.session_state.get("history_saved", 0)
+    if len(messages) > saved:
+        history.get_store().append(history_session(), messages[saved:])
+        st.session_state.history_saved = len(messages)
+
+def delete_history():
+    history.get_store().clear(history_session())
+    st.session_state.messages = []
+    st.session_state.history_saved = 0
+    st.session_state.history_before = None
+
+def archive_history():
+    save_history(st.session_state.messages)
+    history.get_store().archive(history_session())
+    st.session_state.messages = []
+    st.session_state.history_saved = 0
+    st.session_state.history_before = None
+
+# Make the last archived chat the current one again
+def restore_history():
+    store = history.get_store()
+    chat = store.latest_archive(history_session())
+    if chat is None:
+        return False
+    store.restore(history_session(), chat)
+    st.session_state.messages = load_history()
+    return True
+
+def start_new_chat():
+    archive_history()
+    st.session_state.rawtext = []
+    st.session_state.index = None
+    st.session_state.docstore = DocumentStore()
+    if st.session_state.get("process_job"):
+        jobs.queue.cancel(st.session_state.process_job)
+        st.session_state.process_job = None
+
+# st.fragment in newer Streamlit releases, experimental before that
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+# Status of the background Process job, refreshed every second on its own
+# so the chat stays usable while the documents are processed
+@fragment(run_every=1)
+def processing_status():
+    job_id = st.session_state.get("process_job")
+    job = jobs.queue.get(job_id) if job_id else None
+    if job is None:
+        st.session_state.process_job = None
+        return
+
+    if job.running:
+        st.progress(job.progress, text=f"Processing documents... {job.done} of {job.total} parts")
+        if st.button("Cancel Processing", use_container_width=True):
+            jobs.queue.cancel(job_id)
+        return
+
+    jobs.queue.pop(job_id)
+    st.session_state.process_job = None
+    st.session_state.last_trace = job.trace
+    if job.status == 'done':
+        publish_documents(job.result[0])
+        # For work the full run of the page does after a Process, not this fragment
+        st.session_state.documents_processed = True
+        show_notification("Documents processed successfully!")
+        st.rerun()
+    elif job.status == 'failed':
+        st.error(f"An error occurred while processing the documents: {job.error}")
+    else:
+        show_notification("Processing cancelled.", type='error')
+
+# Stage timings of this session's last question or Process run
+def debug_panel():
+    trace = st.session_state.get("last_trace")
+    with st.expander("Debug"):
+        if trace is None:
+            st.caption("Ask a question or process documents to see where the time goes.")
+            return
+        st.caption(f"Last {trace.name}: {trace.seconds * 1000:.0f} ms")
+        st.dataframe(trace.breakdown(), hide_index=True, use_container_width=True)
+        if trace.counters:
+            st.json(trace.counters)
+
+# Make a processed document set the one the chat answers from
+def publish_documents(store):
+    st.session_state.docstore = store
+    st.session_state.rawtext = store.context()
+    st.session_state.index = store.index
+
+# Partial summaries are shown in a placeholder while they are generated and
+# replaced by the final summary, the only text kept as the answer
+def stream_summary(stream):
+    placeholder = st.empty()
+    shown = ""
+    while True:
+        try:
+            shown += next(stream)
+        except StopIteration as done:
+            placeholder.empty()
+            return done.value or ""
+        placeholder.markdown(shown)
+
+# Runs once per server process, so only the first session pays for it
+@st.cache_resource
+def warm_up_models():
+    return md.warm_up()
+
+def show_notification(message, type='info'):
+    notification_placeholder = st.empty()
+    notification_placeholder.markdown(f'<div style="position: fixed; top: 30px; right: 30px; padding: 0.5rem 1rem; margin: 20; background-color: {"#f63366" if type == "error" else "#00A36C"}; color: white; font-weight: bold; border-radius: 5px; box-shadow: 0 2px 5px rgba(0, 0, 0, 0.1); z-index: 999;">{message}</div>', unsafe_allow_html=True)
+    time.sleep(0.5)
+    notification_placeholder.empty()
+
@@ -0,0 +1,99 @@
+import math
+import re
+
+import metrics
+
+# A sentence runs up to and including its closing punctuation
+SENTENCE_RE = re.compile(r"[^.!?]+(?:[.!?]+|$)")
+
+# Tokenizers without a configured limit report a huge model_max_length
+DEFAULT_MAX_LENGTH = 512
+
+def split_sentences(text):
+    spans = []
+    for m in SENTENCE_RE.finditer(text):
+        start, end = m.span()
+        # Leave surrounding whitespace out of the span
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+## Token counts of many texts, tokenized batch_size at a time
+def count_tokens(tokenizer, texts, batch_size=256):
+    counts = []
+    for i in range(0, len(texts), batch_size):
+        ids = tokenizer(texts[i:i + batch_size], add_special_tokens=False)['input_ids']
+        counts.extend(len(x) for x in ids)
+    return counts
+
+## Tokens of a prefix the model puts before every input, e.g. "summarize: " for T5
+def prefix_tokens(tokenizer, prefix):
+    return count_tokens(tokenizer, [prefix])[0] if prefix else 0
+
+## Tokens left for the text once special tokens and reserve (e.g. the question) are taken out
+def token_budget(tokenizer, max_length=None, reserve=0):
+    if max_length is None:
+        max_length = getattr(tokenizer, 'model_max_length', DEFAULT_MAX_LENGTH)
+        if not max_length or max_length > 100000:
+            max_length = DEFAULT_MAX_LENGTH
+    specials = tokenizer.num_special_tokens_to_add() if hasattr(tokenizer, 'num_special_tokens_to_add') else 2
+    return max(1, max_length - specials - reserve)
+
+## A sentence longer than the budget is cut at word boundaries into equal parts
+def split_long(text, start, end, n_tokens, budget):
+    parts = math.ceil(n_tokens / (budget * 0.9))
+    words = [m.span() for m in re.finditer(r"\S+", text[start:end])]
+    per_part = math.ceil(len(words) / parts)
+    spans = []
+    for i in range(0, len(words), per_part):
+        group = words[i:i + per_part]
+        spans.append((start + group[0][0], start + group[-1][1], math.ceil(n_tokens * len(group) / len(words))))
+    return spans
+
+## Pack whole sentences into chunks of at most max_tokens tokens, each chunk
+## starting with up to overlap_tokens tokens of the previous one. Chunks carry
+## their character offsets into text so results can be traced back.
+def chunk_text(text, tokenizer, max_tokens, overlap_tokens=0, batch_size=256):
+    spans = split_sentences(text)
+    with metrics.span('tokenize', sentences=len(spans)):
+        counts = count_tokens(tokenizer, [text[s:e] for s, e in spans], batch_size)
+    metrics.count('tokens', sum(counts), stage='chunking')
+
+    pieces = []
+    for (start, end), n in zip(spans, counts):
+        if n > max_tokens:
+            pieces.extend(split_long(text, start, end, n, max_tokens))
+        else:
+            pieces.append((start, end, n))
+
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + piece[2] > max_tokens:
+            chunks.append(make_chunk(text, current, size))
+            # Carry the last sentences over as overlap, without the new
+            # sentence pushing the next chunk past the budget
+            carry, carried = [], 0
+            for prev in reversed(current):
+                if carried + prev[2] > overlap_tokens or carried + prev[2] + piece[2] > max_tokens:
+                    break
+                carry.insert(0, prev)
+                carried += prev[2]
+            current, size = carry, carried
+        current.append(piece)
+        size += piece[2]
+    if current:
+        chunks.append(make_chunk(text, current, size))
+    return chunks
+
+def make_chunk(text, pieces, size):
+    start, end = pieces[0][0], pieces[-1][1]
+    return {'text': text[start:end], 'start': start, 'end': end, 'tokens': size}
+
+## Chunks sized for a model: budget from its tokenizer minus reserve tokens
+def chunk_for_model(text, tokenizer, max_length=None, reserve=0, overlap_tokens=32):
+    budget = token_budget(tokenizer, max_length, reserve)
+    return chunk_text(text, tokenizer, budget, min(overlap_tokens, budget // 4))
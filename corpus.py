@@ -0,0 +1,191 @@
+from collections.abc import Sequence
+import json
+import mmap
+import os
+import threading
+import weakref
+
+import numpy as np
+
+import doc_cache
+import retrieval
+
+# Processed documents on disk: the cleaned text as one UTF-8 blob, the byte
+# range of every chunk and the chunk metadata. Safe to delete at any time.
+CORPUS_DIR = os.environ.get('CORPUS_DIR', '.corpus')
+CORPUS_MAX_MB = float(os.environ.get('CORPUS_MAX_MB', 500))
+
+# Bump when the file layout changes
+CORPUS_VERSION = 1
+
+def make_key(digest, *settings):
+    return doc_cache.make_key('corpus', CORPUS_VERSION, digest, *settings)
+
+def path(key, suffix, directory=CORPUS_DIR):
+    return os.path.join(directory, key[:2], key + suffix)
+
+def exists(key, directory=CORPUS_DIR):
+    # The metadata is written last, the other files are complete once it is there
+    return os.path.exists(path(key, '.json', directory))
+
+## Char offsets -> byte offsets in the UTF-8 encoding of text, encoding each stretch once
+def byte_offsets(text, positions):
+    offsets, prev_char, prev_byte = {}, 0, 0
+    for p in sorted(set(positions)):
+        prev_byte += len(text[prev_char:p].encode('utf-8'))
+        prev_char = p
+        offsets[p] = prev_byte
+    return offsets
+
+## Write a document and its chunks (dicts with 'text' and, when they are
+## slices of the text, 'start' and 'end' character offsets). info is kept
+## with the metadata.
+def write(key, text, chunks, directory=CORPUS_DIR, **info):
+    blob = bytearray(text.encode('utf-8'))
+    offsets = byte_offsets(text, [p for c in chunks if 'start' in c for p in (c['start'], c['end'])])
+    ranges, meta = [], []
+    for chunk in chunks:
+        if 'start' in chunk:
+            ranges.append((offsets[chunk['start']], offsets[chunk['end']]))
+        else:
+            # Not a slice of the text, stored after it
+            data = chunk['text'].encode('utf-8')
+            ranges.append((len(blob), len(blob) + len(data)))
+            blob.extend(data)
+        meta.append({k: v for k, v in chunk.items() if k != 'text'})
+
+    os.makedirs(os.path.dirname(path(key, '', directory)), exist_ok=True)
+    for suffix, write_file in (
+        ('.txt', lambda f: f.write(blob)),
+        ('.idx.npy', lambda f: np.save(f, np.asarray(ranges, dtype=np.int64).reshape(-1, 2))),
+        ('.json', lambda f: f.write(json.dumps({**info, 'text_bytes': len(text.encode('utf-8')), 'chunks': meta}).encode('utf-8'))),
+    ):
+        target = path(key, suffix, directory)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            write_file(f)
+        os.replace(tmp, target)
+    evict(directory)
+
+SUFFIXES = ('.txt', '.idx.npy', '.json')
+
+## [(last used, bytes, key)] of the documents in the corpus. The metadata file
+## is touched whenever a document is opened, its mtime is the last use.
+def entries(directory=CORPUS_DIR):
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                used = os.stat(os.path.join(root, name)).st_mtime
+                size = sum(os.stat(path(key, suffix, directory)).st_size for suffix in SUFFIXES)
+            except OSError:
+                continue
+            entries.append((used, size, key))
+    return entries
+
+_evict_lock = threading.Lock()
+
+## Remove the least recently used documents until the corpus fits in max_mb.
+## Documents a session has open are kept.
+def evict(directory=CORPUS_DIR, max_mb=CORPUS_MAX_MB):
+    max_bytes = int(max_mb * 1024 * 1024)
+    if max_bytes <= 0:
+        return
+    with _evict_lock:
+        documents = entries(directory)
+        total = sum(size for _, size, _ in documents)
+        for _, size, key in sorted(documents):
+            if total <= max_bytes:
+                break
+            if key in _open:
+                continue
+            # Metadata first, so the document stops existing before its data goes
+            for suffix in reversed(SUFFIXES):
+                try:
+                    os.remove(path(key, suffix, directory))
+                except OSError:
+                    pass
+            total -= size
+
+## Lazy, read-only sequence of the chunk texts of a mapped document
+class ChunkTexts(Sequence):
+
+    def __init__(self, document):
+        self.document = document
+
+    def __len__(self):
+        return len(self.document.ranges)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self.document.ranges[i]
+        return bytes(self.document.blob[start:end]).decode('utf-8')
+
+## A document on disk, memory-mapped. The operating system shares the pages
+## between every session that has the same document open.
+class MappedDocument:
+
+    def __init__(self, key, directory=CORPUS_DIR):
+        self.key = key
+        with open(path(key, '.json', directory), encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.text_bytes = self.info['text_bytes']
+        self.meta = self.info.pop('chunks')
+        self.ranges = np.load(path(key, '.idx.npy', directory), mmap_mode='r')
+        if os.path.getsize(path(key, '.txt', directory)):
+            with open(path(key, '.txt', directory), 'rb') as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.blob = b''  # empty files can't be mapped
+        self.chunks = ChunkTexts(self)
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __bool__(self):
+        return self.text_bytes > 0
+
+    def text(self):
+        return bytes(self.blob[:self.text_bytes]).decode('utf-8')
+
+    ## BM25 index of the chunks, built once and shared like the text
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = retrieval.BM25Index(self.chunks)
+            return self._index
+
+_open = weakref.WeakValueDictionary()
+_open_lock = threading.Lock()
+
+## The mapped document of key, the same object for every caller while it is in use
+def open_document(key, directory=CORPUS_DIR):
+    with _open_lock:
+        document = _open.get(key)
+        if document is None:
+            document = MappedDocument(key, directory)
+            _open[key] = document
+            try:
+                os.utime(path(key, '.json', directory))  # mark as recently used
+            except OSError:
+                pass
+        return document
+
+## Combined text of several mapped documents, only read from disk when a
+## caller needs the string (summaries, readers without an index)
+class LazyText:
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def __bool__(self):
+        return any(self.documents)
+
+    def __str__(self):
+        return " ".join(d.text() for d in self.documents if d)
@@ -0,0 +1,106 @@
+import os
+import re
+import zlib
+
+import numpy as np
+
+import metrics
+
+# Estimated Jaccard similarity of word shingles above which a chunk counts as
+# a copy of an earlier one, 0 turns deduplication off
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.85))
+
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+BANDS = 16  # of NUM_PERM // BANDS rows, catches pairs well below the threshold
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+WORD_RE = re.compile(r"\w+")
+
+def shingles(text, k=SHINGLE_WORDS):
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+## MinHash signature: per permutation the smallest hash of the shingles
+def signature(text):
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text)), dtype=np.uint64)
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+## For every text the position of the earlier text it duplicates, or None.
+## Candidates come from LSH buckets over signature bands, only kept texts are
+## bucketed so every copy points at the first occurrence.
+def find_duplicates(texts, threshold=DEDUP_THRESHOLD):
+    dup_of = [None] * len(texts)
+    if threshold <= 0:
+        return dup_of
+
+    rows = NUM_PERM // BANDS
+    exact = {}
+    buckets = {}
+    signatures = {}
+    for i, text in enumerate(texts):
+        normalised = " ".join(WORD_RE.findall(text.lower()))
+        if normalised in exact:
+            dup_of[i] = exact[normalised]
+            continue
+
+        sig = signature(text)
+        keys = [(b, sig[b * rows:(b + 1) * rows].tobytes()) for b in range(BANDS)]
+        candidates = {j for key in keys for j in buckets.get(key, ())}
+        best, best_sim = None, threshold
+        for j in sorted(candidates):
+            sim = float(np.mean(signatures[j] == sig))
+            if sim >= best_sim:
+                best, best_sim = j, sim
+        if best is not None:
+            dup_of[i] = best
+            continue
+
+        exact[normalised] = i
+        signatures[i] = sig
+        for key in keys:
+            buckets.setdefault(key, []).append(i)
+    return dup_of
+
+## Texts without their near duplicates, plus what dropping them saved
+def dedupe_texts(texts, threshold=DEDUP_THRESHOLD, tokens=None):
+    dup_of = find_duplicates(texts, threshold)
+    kept = [t for t, d in zip(texts, dup_of) if d is None]
+    return kept, report(texts, dup_of, tokens)
+
+## Chunk dicts without their near duplicates. Every kept chunk lists the
+## provenance (doc, chunk, offsets, ...) of the copies collapsed into it.
+def dedupe_chunks(chunks, threshold=DEDUP_THRESHOLD):
+    chunks = [c if isinstance(c, dict) else {'text': c, 'chunk': i} for i, c in enumerate(chunks)]
+    dup_of = find_duplicates([c['text'] for c in chunks], threshold)
+    kept = {}
+    for i, (chunk, d) in enumerate(zip(chunks, dup_of)):
+        if d is None:
+            kept[i] = dict(chunk)
+        else:
+            provenance = {k: v for k, v in chunk.items() if k not in ('text', 'duplicates')}
+            kept[d].setdefault('duplicates', []).append(provenance)
+    tokens = [c.get('tokens') for c in chunks]
+    return list(kept.values()), report([c['text'] for c in chunks], dup_of, tokens if None not in tokens else None)
+
+def report(texts, dup_of, tokens=None):
+    dropped = [i for i, d in enumerate(dup_of) if d is not None]
+    stats = {
+        'chunks': len(texts),
+        'dropped': len(dropped),
+        'chars_saved': sum(len(texts[i]) for i in dropped),
+    }
+    if tokens is not None:
+        stats['tokens_saved'] = sum(tokens[i] for i in dropped)
+    if dropped:
+        metrics.count('dedup_dropped_chunks', len(dropped))
+        metrics.count('dedup_saved_chars', stats['chars_saved'])
+        if 'tokens_saved' in stats:
+            metrics.count('dedup_saved_tokens', stats['tokens_saved'])
+    return stats
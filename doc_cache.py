@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+
+import metrics
+
+CACHE_DIR = os.environ.get('DOC_CACHE_DIR', '.doc_cache')
+CACHE_MAX_MB = float(os.environ.get('DOC_CACHE_MAX_MB', 500))
+# Eviction goes below the limit by this share, so the next writes don't each evict again
+EVICT_TO = 0.9
+
+# Bump when the extraction code changes so old entries are not reused
+EXTRACT_VERSION = 1
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+## Text files on disk named by key, oldest (least recently read) evicted first.
+## The size of the directory is counted once and then kept up to date by
+## set(), it is only walked again when the count passes max_mb. Files other
+## processes write are not counted until then.
+class DiskCache:
+
+    def __init__(self, directory=CACHE_DIR, max_mb=CACHE_MAX_MB, suffix='.txt', name='document'):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, None until first counted
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            self.misses += 1
+            metrics.count('cache_misses', cache=self.name)
+            return None
+        self.hits += 1
+        metrics.count('cache_hits', cache=self.name)
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(value)
+        size = os.path.getsize(tmp)
+        try:
+            size -= os.path.getsize(path)  # replaced entry
+        except OSError:
+            pass
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()
+            else:
+                self._size += size
+            full = self.max_bytes > 0 and self._size > self.max_bytes
+        if full:
+            self.evict()
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+            self._size = total
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = None
+
+cache = DiskCache()
+
+def extract_key(digest, file_type):
+    return make_key('extract', EXTRACT_VERSION, file_type, digest)
+
+def clean_key(digest, file_type, settings):
+    return make_key('clean', EXTRACT_VERSION, settings, file_type, digest)
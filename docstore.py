@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import preprocess as pp
+import model as md
+import corpus
+import dedup
+import metrics
+import retrieval
+
+## What the chunks of a document depend on besides its content
+def chunker_id(chunker):
+    if chunker is md.reader_chunks:
+        return f"reader:{md.model_id('roberta')}:{md.QA_MAX_LENGTH}:{md.QA_QUESTION_RESERVE}:{md.QA_CHUNK_OVERLAP}"
+    return f"{chunker.__module__}.{chunker.__qualname__}"
+
+## Per-session set of processed documents, tracked by content hash so a new
+## Process only extracts, chunks and indexes the files that changed. The
+## documents live in the on-disk corpus, memory-mapped and shared with every
+## other session that uploaded the same file.
+class DocumentStore:
+
+    # chunker(text) returns the chunks of one document, as strings or as
+    # dicts with 'text' and character offsets
+    def __init__(self, chunker=None):
+        self.chunker = chunker or md.reader_chunks
+        self.docs = OrderedDict()  # content hash -> {'name', 'corpus', 'dedup'}
+        self.index = retrieval.SegmentedIndex()
+
+    def corpus_key(self, digest):
+        return corpus.make_key(digest, pp.PREPROCESS_SETTINGS, chunker_id(self.chunker), dedup.DEDUP_THRESHOLD)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, digest):
+        return digest in self.docs
+
+    ## Bring the store in line with the current uploads, returns (added, removed) names
+    def sync(self, docs_collection, progress=None):
+        items = pp.upload_items(docs_collection)
+        current = {digest for _, _, _, digest in items}
+
+        removed = [self.docs[digest]['name'] for digest in list(self.docs) if digest not in current]
+        for digest in list(self.docs):
+            if digest not in current:
+                self.remove(digest)
+
+        # The same file uploaded twice is only processed once
+        new_items = list({item[3]: item for item in items if item[3] not in self.docs}.values())
+        # Documents already in the corpus skip extraction, chunking and deduplication
+        missing = []
+        for item in new_items:
+            name, _, _, digest = item
+            if corpus.exists(self.corpus_key(digest)):
+                try:
+                    self.attach(digest, name)
+                    metrics.count('cache_hits', cache='corpus')
+                    continue
+                except OSError:
+                    pass  # evicted in the meantime
+            metrics.count('cache_misses', cache='corpus')
+            missing.append(item)
+        # The corpus keeps the cleaned text, the document cache only the extracted text
+        texts = pp.preprocess_items(missing, progress, cache_cleaned=False)
+        for (name, _, _, digest), text in zip(missing, texts):
+            self.add(digest, name, text)
+
+        # Keep the upload order so the combined text reads like before
+        order = {digest: i for i, (_, _, _, digest) in enumerate(items)}
+        for digest in sorted(self.docs, key=order.get):
+            self.docs.move_to_end(digest)
+            self.index.segments.move_to_end(digest)
+
+        return [name for name, _, _, _ in new_items], removed
+
+    # Documents and index segments are never changed in place, so copies can share them
+    def copy(self):
+        store = DocumentStore(self.chunker)
+        store.docs = OrderedDict(self.docs)
+        store.index.segments = OrderedDict(self.index.segments)
+        store.index.chunk_meta = dict(self.index.chunk_meta)
+        return store
+
+    def add(self, digest, name, text):
+        with metrics.span('chunk', doc=name):
+            chunks = self.chunker(text) if text else []
+        # Headers, footers and disclaimers repeated on every page are indexed once
+        with metrics.span('dedup', doc=name, chunks=len(chunks)):
+            chunks, dedup_stats = dedup.dedupe_chunks(chunks)
+        with metrics.span('corpus.write', doc=name, chunks=len(chunks)):
+            corpus.write(self.corpus_key(digest), text, chunks, dedup=dedup_stats)
+        self.attach(digest, name)
+
+    def attach(self, digest, name):
+        document = corpus.open_document(self.corpus_key(digest))
+        self.docs[digest] = {'name': name, 'corpus': document, 'dedup': document.info.get('dedup')}
+        with metrics.span('index', doc=name, chunks=len(document)):
+            self.index.add_index(digest, document.index(), document.meta, doc=name)
+
+    def remove(self, digest):
+        self.docs.pop(digest, None)
+        self.index.remove(digest)
+
+    ## Combined text of the documents, read from disk when it is used
+    def context(self):
+        return corpus.LazyText(doc['corpus'] for doc in self.docs.values())
+
+    def text(self):
+        return str(self.context())
+
+    def chunks(self):
+        chunks = []
+        for doc in self.docs.values():
+            document = doc['corpus']
+            for i, (text, meta) in enumerate(zip(document.chunks, document.meta)):
+                chunks.append({'text': text, **meta, 'chunk': i, 'doc': doc['name']})
+        return chunks
+
+    def names(self):
+        return [doc['name'] for doc in self.docs.values()]
+
+## Background job: sync a copy of the store, the session keeps answering from
+## the current documents until the new set is published
+def process_job(job, store, docs_collection):
+    with metrics.trace('process', files=len(docs_collection)) as trace:
+        job.trace = trace
+        store = store.copy()
+        added, removed = store.sync(docs_collection, progress=job.update)
+        job.check_cancelled()
+    return store, added, removed
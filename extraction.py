@@ -0,0 +1,139 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import multiprocessing
+import os
+import threading
+import time
+
+import metrics
+
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 1))
+# Workers are started fresh instead of forked: the pool is created from a job
+# thread of a process that may already run torch or tokenizers threads, and a
+# forked copy of their locks can deadlock
+EXTRACT_START_METHOD = os.environ.get('EXTRACT_START_METHOD', 'spawn')
+
+# Large PDFs are split into ranges of this many pages, one pool task each
+PAGES_PER_TASK = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(workers=EXTRACT_WORKERS):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(EXTRACT_START_METHOD))
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+class NamedBytesIO(io.BytesIO):
+    # Some readers look at the name of the upload, keep it on the buffer
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+## Runs inside a worker process, only plain bytes and ints cross the process boundary.
+## start and end only label a part of a larger PDF, data holds just those pages.
+def extract_task(name, file_type, data, start=None, end=None):
+    import preprocess as pp
+
+    return pp.read_text_from_file(NamedBytesIO(data, name), file_type)
+
+## extract_task and the seconds it took in the worker, reported as a stage of the caller's trace
+def timed_extract_task(name, file_type, data, start=None, end=None):
+    started = time.perf_counter()
+    text = extract_task(name, file_type, data, start, end)
+    return text, time.perf_counter() - started
+
+def stage_name(file_type):
+    return 'extract.ocr' if file_type in ('jpeg', 'jpg', 'png') else f'extract.{file_type}'
+
+## Page count of a PDF and, when it has more than pages_per_task pages, its
+## page ranges as (start, end, bytes of a PDF with only those pages). A task
+## then ships and parses its own pages instead of the whole file.
+def split_pdf(data, pages_per_task=PAGES_PER_TASK):
+    from PyPDF2 import PdfReader, PdfWriter
+
+    reader = PdfReader(io.BytesIO(data))
+    n_pages = len(reader.pages)
+    if n_pages <= pages_per_task:
+        return n_pages, None
+    parts = []
+    for start in range(0, n_pages, pages_per_task):
+        end = min(start + pages_per_task, n_pages)
+        writer = PdfWriter()
+        for page in range(start, end):
+            writer.add_page(reader.pages[page])
+        out = io.BytesIO()
+        writer.write(out)
+        parts.append((start, end, out.getvalue()))
+    return n_pages, parts
+
+## Split the uploads into tasks: (file position, part position, task arguments)
+def plan_tasks(items, pages_per_task=PAGES_PER_TASK):
+    tasks = []
+    for i, (name, file_type, data) in enumerate(items):
+        metrics.count('bytes_processed', len(data), type=file_type)
+        if file_type == "pdf":
+            n_pages, parts = split_pdf(data, pages_per_task)
+            metrics.count('pages_processed', n_pages)
+            if parts:
+                for part, (start, end, part_data) in enumerate(parts):
+                    tasks.append((i, part, (name, file_type, part_data, start, end)))
+                continue
+        tasks.append((i, 0, (name, file_type, data)))
+    return tasks
+
+# Worker time of a task as a stage of the trace running in this process
+def record_task(args, seconds):
+    name, file_type = args[:2]
+    fields = {'file': name}
+    if len(args) > 3:
+        fields['pages'] = f"{args[3] + 1}-{args[4]}"
+    metrics.observe(stage_name(file_type), seconds, **fields)
+
+## Extract the text of (name, file_type, bytes) items, in the order they were given.
+## progress(done, total) is called in the calling thread after every finished task.
+def extract_texts(items, workers=EXTRACT_WORKERS, progress=None, pages_per_task=PAGES_PER_TASK):
+    items = list(items)
+    tasks = plan_tasks(items, pages_per_task)
+    parts = [dict() for _ in items]
+    total = len(tasks)
+
+    if workers <= 1 or total <= 1:
+        for done, (i, part, args) in enumerate(tasks, 1):
+            parts[i][part], seconds = timed_extract_task(*args)
+            record_task(args, seconds)
+            if progress:
+                progress(done, total)
+    else:
+        pool = get_pool(workers)
+        futures = {pool.submit(timed_extract_task, *args): (i, part, args) for i, part, args in tasks}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                i, part, args = futures[future]
+                parts[i][part], seconds = future.result()
+                record_task(args, seconds)
+                if progress:
+                    progress(done, total)
+        except BaseException:
+            # The progress callback may stop us (e.g. a cancelled job), drop the queued work
+            for future in futures:
+                future.cancel()
+            raise
+
+    texts = []
+    for file_parts in parts:
+        pieces = [file_parts[k] for k in sorted(file_parts)]
+        if any(p is None for p in pieces):
+            texts.append(None)  # unsupported file type
+        else:
+            texts.append("".join(pieces))
+    return texts
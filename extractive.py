@@ -0,0 +1,112 @@
+import math
+import os
+import re
+import zlib
+
+import numpy as np
+
+import chunking
+
+# Token budget of the sentences handed to the abstractive summarizer,
+# 0 summarises the whole text
+SUMMARY_EXTRACT_TOKENS = int(os.environ.get('SUMMARY_EXTRACT_TOKENS', 0))
+# 'centroid' is linear in the text length, 'textrank' compares every pair of sentences
+SUMMARY_EXTRACT_METHOD = os.environ.get('SUMMARY_EXTRACT_METHOD', 'centroid')
+
+# Words are hashed into this many features instead of keeping a vocabulary
+HASH_DIM = 1 << 14
+# TextRank builds a sentences x sentences matrix, longer texts use the centroid
+TEXTRANK_MAX_SENTENCES = 1500
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_ITERATIONS = 30
+# Headings and page numbers are never picked
+MIN_SENTENCE_WORDS = 4
+
+WORD_RE = re.compile(r"\w+")
+
+## Sparse TF-IDF rows of the sentences as (row, feature, weight) arrays, each row of unit length
+def sentence_features(sentences, dim=HASH_DIM):
+    rows, cols = [], []
+    for i, sentence in enumerate(sentences):
+        for word in WORD_RE.findall(sentence.lower()):
+            rows.append(i)
+            cols.append(zlib.crc32(word.encode('utf-8')) % dim)
+    n = len(sentences)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Term counts per (sentence, feature) pair
+    pairs, tf = np.unique(np.array(rows, dtype=np.int64) * dim + np.array(cols, dtype=np.int64), return_counts=True)
+    rows, cols = pairs // dim, pairs % dim
+    df = np.bincount(cols, minlength=dim)
+    weights = (1 + np.log(tf)) * (np.log((1 + n) / (1 + df[cols])) + 1)
+    norms = np.sqrt(np.bincount(rows, weights ** 2, minlength=n))
+    return rows, cols, weights / norms[rows]
+
+## Cosine similarity of every sentence to the mean of all of them
+def centroid_scores(n, rows, cols, weights, dim=HASH_DIM):
+    centroid = np.bincount(cols, weights, minlength=dim) / max(n, 1)
+    return np.bincount(rows, weights * centroid[cols], minlength=n)
+
+## PageRank over the sentence similarity graph
+def textrank_scores(n, rows, cols, weights, dim=HASH_DIM):
+    # Only the features in use get a column
+    used, cols = np.unique(cols, return_inverse=True)
+    x = np.zeros((n, len(used)), dtype=np.float32)
+    x[rows, cols] = weights
+    sim = x @ x.T
+    np.fill_diagonal(sim, 0.0)
+    out = sim.sum(axis=1, keepdims=True)
+    transition = np.divide(sim, out, out=np.zeros_like(sim), where=out > 0)
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(TEXTRANK_ITERATIONS):
+        scores = (1 - TEXTRANK_DAMPING) / n + TEXTRANK_DAMPING * (transition.T @ scores)
+    return scores
+
+## The best sentences of the text that fit in max_tokens, in document order.
+## Returns the text and stats of what was kept.
+def select(text, max_tokens=SUMMARY_EXTRACT_TOKENS, tokenizer=None, method=SUMMARY_EXTRACT_METHOD):
+    spans = chunking.split_sentences(text)
+    sentences = [text[s:e] for s, e in spans]
+
+    # Repeated sentences would only vote for each other
+    seen, candidates = set(), []
+    for i, sentence in enumerate(sentences):
+        key = " ".join(WORD_RE.findall(sentence.lower()))
+        if key in seen or len(key.split()) < MIN_SENTENCE_WORDS:
+            continue
+        seen.add(key)
+        candidates.append(i)
+
+    stats = {'sentences': len(sentences), 'candidates': len(candidates), 'method': method}
+    if not candidates:
+        stats.update(kept=0, tokens=0)
+        return text, stats
+
+    picked = [sentences[i] for i in candidates]
+    rows, cols, weights = sentence_features(picked)
+    if method == 'textrank' and len(picked) <= TEXTRANK_MAX_SENTENCES:
+        scores = textrank_scores(len(picked), rows, cols, weights)
+    else:
+        stats['method'] = 'centroid'
+        scores = centroid_scores(len(picked), rows, cols, weights)
+
+    if tokenizer is not None:
+        counts = chunking.count_tokens(tokenizer, picked)
+    else:
+        counts = [math.ceil(len(s.split()) * 1.3) for s in picked]  # about 1.3 tokens per word
+    if sum(counts) <= max_tokens:
+        # Already short enough, nothing to leave out
+        stats.update(kept=len(sentences), tokens=sum(counts))
+        return text, stats
+
+    chosen, used = [], 0
+    for j in np.argsort(-scores, kind='stable'):
+        if used + counts[j] > max_tokens:
+            continue
+        chosen.append(candidates[j])
+        used += counts[j]
+
+    chosen.sort()
+    stats.update(kept=len(chosen), tokens=used)
+    return " ".join(sentences[i] for i in chosen), stats
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+import sqlite_conn
+
+HISTORY_DB = os.environ.get('HISTORY_DB', 'chat_history.db')
+CURRENT = 'current'
+# Shelve files of the single chat history the app kept before, and of the
+# chat saved by its "New Chat"
+LEGACY_HISTORY = os.environ.get('LEGACY_HISTORY', 'chat_history')
+LEGACY_OLD_HISTORY = os.environ.get('LEGACY_OLD_HISTORY', 'old_chat_history')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    chat TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat ON messages (session, chat, id);
+CREATE TABLE IF NOT EXISTS imports (
+    name TEXT PRIMARY KEY,
+    session TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+## Chat messages in SQLite, one row per message. WAL mode lets sessions read
+## while another one writes, and every write only appends its new rows.
+class HistoryStore:
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._connect = sqlite_conn.ThreadConnections(path)
+        self._imported = False
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def append(self, session, messages, chat=CURRENT):
+        if not messages:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO messages (session, chat, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                             [(session, chat, m["role"], m["content"], now) for m in messages])
+
+    ## Newest `limit` messages older than message id `before`, oldest first.
+    ## Returns the messages and the id to pass as `before` for the previous page.
+    def load_page(self, session, chat=CURRENT, limit=None, before=None):
+        query = "SELECT id, role, content FROM messages WHERE session = ? AND chat = ?"
+        params = [session, chat]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._connect().execute(query, params).fetchall()
+        rows.reverse()
+        first_id = rows[0][0] if rows else None
+        return [{"role": role, "content": content} for _, role, content in rows], first_id
+
+    def load(self, session, chat=CURRENT):
+        return self.load_page(session, chat)[0]
+
+    def count(self, session, chat=CURRENT):
+        return self._connect().execute("SELECT COUNT(*) FROM messages WHERE session = ? AND chat = ?", (session, chat)).fetchone()[0]
+
+    def clear(self, session, chat=CURRENT):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session = ? AND chat = ?", (session, chat))
+
+    ## Move the current chat into a new archive, returns the archive name
+    def archive(self, session):
+        name = f"archive:{time.time():.6f}"
+        with self._connect() as conn:
+            conn.execute("UPDATE messages SET chat = ? WHERE session = ? AND chat = ?", (name, session, CURRENT))
+        return name
+
+    def latest_archive(self, session):
+        row = self._connect().execute(
+            "SELECT chat FROM messages WHERE session = ? AND chat LIKE 'archive:%' ORDER BY id DESC LIMIT 1", (session,)).fetchone()
+        return row[0] if row else None
+
+    ## Replace the current chat with a copy of an archived one
+    def restore(self, session, chat):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session = ? AND chat = ?", (session, CURRENT))
+            conn.execute("INSERT INTO messages (session, chat, role, content, created) "
+                         "SELECT session, ?, role, content, created FROM messages WHERE session = ? AND chat = ? ORDER BY id",
+                         (CURRENT, session, chat))
+
+    ## The old shelve history was one chat shared by every browser, it is
+    ## imported once, into the first session that loads its history: the saved
+    ## chat as the current one and the one before "New Chat" as an archive.
+    ## Returns the number of imported messages.
+    def import_shelve(self, session, path=LEGACY_HISTORY, old_path=LEGACY_OLD_HISTORY):
+        if self._imported:
+            return 0
+        self._imported = True
+        with self._connect() as conn:
+            # The primary key lets only one session and one process do the import
+            claimed = conn.execute("INSERT OR IGNORE INTO imports (name, session, created) VALUES ('shelve', ?, ?)",
+                                   (session, time.time())).rowcount
+            if not claimed:
+                return 0
+            old_messages, messages = read_shelve(old_path), read_shelve(path)
+            now = time.time()
+            rows = [(session, f"archive:{now:.6f}", m["role"], m["content"], now) for m in old_messages]
+            rows += [(session, CURRENT, m["role"], m["content"], now) for m in messages]
+            conn.executemany("INSERT INTO messages (session, chat, role, content, created) VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+## Messages saved in a shelve file by the old app, [] if there is none
+def read_shelve(path):
+    import dbm
+    import shelve
+
+    if not dbm.whichdb(path):
+        return []
+    try:
+        with shelve.open(path, flag='r') as db:
+            return list(db.get("messages", []))
+    except dbm.error:
+        return []
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import uuid
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+
+# Finished jobs are forgotten after this many seconds if nobody collects them
+JOB_RETENTION = 3600
+
+class JobCancelled(Exception):
+    pass
+
+## A unit of background work. The function gets the job as its first argument
+## and reports through job.update(done, total), which also stops it on cancel.
+class Job:
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = 'queued'  # queued, running, done, failed, cancelled
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.trace = None  # metrics.Trace of the run, if the function records one
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    def update(self, done, total):
+        self.done, self.total = done, total
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def running(self):
+        return self.status in ('queued', 'running')
+
+class JobQueue:
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args, **kwargs):
+        job = Job(name)
+        with self._lock:
+            self._forget_old()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished = time.time()
+            return
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = e
+            job.status = 'failed'
+        job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def _forget_old(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished > JOB_RETENTION:
+                del self._jobs[job_id]
+
+# Process-wide queue, sessions keep the ids of their own jobs
+queue = JobQueue()
@@ -0,0 +1,208 @@
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+# Prometheus text file rewritten after every request, e.g. for node_exporter's textfile collector
+METRICS_FILE = os.environ.get('METRICS_FILE')
+# One JSON line per finished request is logged, to this file or '-' for stderr
+METRICS_LOG = os.environ.get('METRICS_LOG')
+PREFIX = 'chatbot'
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger(__name__)
+if METRICS_LOG:
+    _handler = logging.StreamHandler() if METRICS_LOG == '-' else logging.FileHandler(METRICS_LOG)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+## One request (a question, a Process run): its spans in start order with
+## their nesting depth, and the counters incremented while it ran
+class Trace:
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.started = time.time()
+        self.seconds = None
+        self.spans = []
+        self.counters = {}
+
+    # Rows for display: indented stage name, milliseconds and the other fields.
+    # Em spaces indent, plain ones are collapsed by the browser.
+    def breakdown(self):
+        rows = []
+        for s in self.spans:
+            details = ", ".join(f"{k}={v}" for k, v in s.items() if k not in ('stage', 'depth', 'seconds'))
+            ms = round(s['seconds'] * 1000, 1) if s['seconds'] is not None else None
+            rows.append({'stage': "\u2003" * s['depth'] + s['stage'], 'ms': ms, 'details': details})
+        return rows
+
+    def as_dict(self):
+        return {
+            'trace': self.name,
+            **self.fields,
+            'started': self.started,
+            'seconds': self.seconds,
+            'spans': self.spans,
+            'counters': self.counters,
+        }
+
+_trace = contextvars.ContextVar('trace', default=None)
+_depth = contextvars.ContextVar('span_depth', default=0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # stage -> [count per bucket..., sum, count]
+
+# Last finished traces of the process, newest last
+recent = deque(maxlen=50)
+
+def _reset(var, token, default):
+    try:
+        var.reset(token)
+    except ValueError:
+        # A generator finished in another context than it started in
+        var.set(default)
+
+def current():
+    return _trace.get()
+
+def count(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    trace = _trace.get()
+    if trace is not None:
+        label = name + ''.join(f"[{k}={v}]" for k, v in key[1])
+        trace.counters[label] = trace.counters.get(label, 0) + value
+
+def _histogram(stage, seconds):
+    with _lock:
+        hist = _histograms.setdefault(stage, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+## Record a stage that was timed elsewhere, e.g. in a worker process
+def observe(stage, seconds, **fields):
+    _histogram(stage, seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append({'stage': stage, 'depth': _depth.get(), 'seconds': seconds, **fields})
+    logger.debug(json.dumps({'event': 'span', 'stage': stage, 'seconds': round(seconds, 6), **fields}, default=str))
+
+## Time a stage. The yielded dict can be filled with fields while it runs.
+@contextmanager
+def span(stage, **fields):
+    trace = _trace.get()
+    entry = {'stage': stage, 'depth': _depth.get(), 'seconds': None}
+    if trace is not None:
+        trace.spans.append(entry)
+    token = _depth.set(entry['depth'] + 1)
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        seconds = time.perf_counter() - start
+        _reset(_depth, token, entry['depth'])
+        entry['seconds'] = seconds
+        entry.update(fields)
+        _histogram(stage, seconds)
+        logger.debug(json.dumps({'event': 'span', 'stage': stage, 'seconds': round(seconds, 6), **fields}, default=str))
+
+## Time a whole request. Inside another trace it is recorded as a span of it.
+@contextmanager
+def trace(name, **fields):
+    parent = _trace.get()
+    if parent is not None:
+        with span(name, **fields):
+            yield parent
+        return
+
+    t = Trace(name, **fields)
+    token = _trace.set(t)
+    start = time.perf_counter()
+    try:
+        yield t
+    finally:
+        t.seconds = time.perf_counter() - start
+        _reset(_trace, token, None)
+        _histogram(name, t.seconds)
+        recent.append(t)
+        logger.info(json.dumps({'event': 'trace', **t.as_dict()}, default=str))
+        if METRICS_FILE:
+            write_textfile(METRICS_FILE)
+
+## Decorator version of span()
+def timed(stage):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def last_trace(name=None):
+    for t in reversed(recent):
+        if name is None or t.name == name:
+            return t
+    return None
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+## All counters and stage histograms in the Prometheus text format
+def render():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((stage, list(hist)) for stage, hist in _histograms.items())
+
+    declared = set()
+    for (name, labels), value in counters:
+        metric = f"{PREFIX}_{name}_total"
+        if metric not in declared:
+            lines.append(f"# TYPE {metric} counter")
+            declared.add(metric)
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    if histograms:
+        metric = f"{PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for stage, hist in histograms:
+            for bound, n in zip(BUCKETS, hist):
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {n}')
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {hist[-1]}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {hist[-2]:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {hist[-1]}')
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path):
+    # Written next to the target and swapped in, so a scraper never reads half a file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(render())
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("could not write metrics to %s: %s", path, e)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    recent.clear()
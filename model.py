@@ -1,78 +1,330 @@
-from transformers import pipeline, RobertaTokenizer, RobertaForQuestionAnswering, T5Tokenizer, T5ForConditionalGeneration
-from transformers import BertTokenizer, BertForQuestionAnswering, DistilBertTokenizer, DistilBertForQuestionAnswering
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-import preprocess as pp
+from registry import get_pipeline, get_tokenizer, model_id, registry
+import chunking
+import dedup
+import extractive
+import metrics
+import result_cache
+import retrieval
+import router
+import summarizer
 import streamlit as st
+import os
+import re
+import time
+
+RETRIEVAL_TOP_K = 8
+QA_BATCH_SIZE = 8
+
+# Reader chunks fit one question-answering window (the pipeline's max_seq_len)
+# with room left for the question, so the pipeline never splits them again
+QA_MAX_LENGTH = 384
+QA_QUESTION_RESERVE = 64
+QA_CHUNK_OVERLAP = 32
+
+# 'roberta' always uses the RoBERTa reader, 'cascade' tries the cheaper
+# readers in CASCADE_TIERS first and escalates on low confidence
+QA_MODE = os.environ.get('QA_MODE', 'roberta')
+CASCADE_TIERS = [t.strip() for t in os.environ.get('CASCADE_TIERS', 'distilbert,roberta').split(',') if t.strip()]
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', 0.5))
+
+# Map-reduce summary settings, max_seconds/max_tokens of None means no budget
+SUMMARY_BATCH_SIZE = 8
+SUMMARY_TARGET_CHARS = 1500
+SUMMARY_MAX_SECONDS = 120
+SUMMARY_MAX_TOKENS = None
+
+# Modes whose result is a list of {'summary_text'} instead of an answer
+SUMMARY_MODES = (router.SUMMARIZE, router.SUMMARIZE_SECTION)
+
+# Chunks retrieved as "the section" of a summarize-section request
+SECTION_TOP_K = 4
+
+# Entity groups of the NER model, asked for by words in the question.
+# No group named in the question lists all of them.
+ENTITY_TYPES = [
+    ('PER', re.compile(r"\b(?:people|persons?|names?|who)\b", re.IGNORECASE)),
+    ('ORG', re.compile(r"\b(?:compan(?:y|ies)|organi[sz]ations?|firms?)\b", re.IGNORECASE)),
+    ('LOC', re.compile(r"\b(?:places?|locations?|cities|countries|where)\b", re.IGNORECASE)),
+]
+ENTITY_LABELS = {'PER': 'People', 'ORG': 'Organisations', 'LOC': 'Places', 'MISC': 'Other'}
+ENTITY_MIN_SCORE = 0.8
+NO_ENTITIES = "No names of people, organisations or places were found in the documents."
+
+# What a summary was made with, part of its cache key
+def summary_id():
+    if not extractive.SUMMARY_EXTRACT_TOKENS:
+        return model_id('T5')
+    return f"{model_id('T5')}+{extractive.SUMMARY_EXTRACT_METHOD}:{extractive.SUMMARY_EXTRACT_TOKENS}"
+
+# summarizer or question_answering, plus summarize_section and list_entities
+# with ROUTER=classifier
+def route(question):
+    return router.route(question)
+
+def model(question, context, index=None):
+    with metrics.trace('question') as trace:
+        with metrics.span('route'):
+            mode = route(question)
+        trace.fields['mode'] = mode
+        doc_key = result_cache.document_key(context, index)
+        if mode == 'summarizer':
+            # Every summary request over the same documents gets the same summary
+            key = result_cache.make_key(doc_key, 'summarizer', '', summary_id())
+            return result_cache.cache.get_or_compute(key, lambda: T5(context)), 'summarizer'
+        elif mode == router.SUMMARIZE_SECTION:
+            key = result_cache.make_key(doc_key, mode, question, summary_id())
+            return result_cache.cache.get_or_compute(key, lambda: summarize_section(question, context, index)), mode
+        elif mode == router.LIST_ENTITIES:
+            key = result_cache.make_key(doc_key, mode, question, model_id('ner'))
+            return result_cache.cache.get_or_compute(key, lambda: entities(question, context, index)), mode
+        else:
+             if QA_MODE == 'cascade':
+                 reader_id = f"cascade:{','.join(model_id(t) for t in CASCADE_TIERS)}>={CASCADE_THRESHOLD}"
+                 run = lambda: cascade(question, context, index)
+             else:
+                 reader_id = model_id('roberta')
+                 run = lambda: answer(question, context, index)
+             key = result_cache.make_key(doc_key, 'question_answering', question, reader_id)
+             res = result_cache.cache.get_or_compute(key, run)
+             # Cached answers keep the tier that gave them
+             if res and 'tier' in res:
+                 trace.fields['tier'] = res['tier']
+             return res, 'question_answering'
+
+def answer(question, context, index=None, name='roberta'):
+    # Only read the chunks relevant to the question when an index was built
+    if index is not None and len(index):
+        with metrics.span('retrieve', top_k=RETRIEVAL_TOP_K):
+            chunks = retrieval.retrieve(index, question, top_k=RETRIEVAL_TOP_K)
+        # Several versions of a document retrieve the same passage more than once
+        chunks, _ = dedup.dedupe_chunks(chunks)
+        return best_answer(roberta_chunks(question, chunks, name=name))
+    return QA_FUNCTIONS[name](question, str(context))
+
+## Cheap reader first, the next tier is only asked when the answer score is
+## below threshold or no answer span was found
+def cascade(question, context, index=None, threshold=None, tiers=None):
+    threshold = CASCADE_THRESHOLD if threshold is None else threshold
+    tiers = tiers or CASCADE_TIERS
+    route = []
+    for i, name in enumerate(tiers):
+        # One span per tier tried, with its score and decision as fields
+        with metrics.span('cascade', tier=name, threshold=threshold) as fields:
+            start = time.perf_counter()
+            res = answer(question, context, index, name=name)
+            latency = time.perf_counter() - start
+
+            score = res['score'] if res else 0.0
+            confident = bool(res and res['answer'].strip()) and score >= threshold
+            last = i == len(tiers) - 1
+            decision = 'accept' if confident else ('fallback' if last else 'escalate')
+            fields.update(score=round(score, 4), decision=decision)
+            if res is None:
+                # The tier failed to load or run, it was reported and the next one is tried
+                fields['error'] = True
+        metrics.count('cascade_decisions', tier=name, decision=decision)
+        route.append({'tier': name, 'score': score, 'latency': round(latency, 4), 'decision': decision})
+
+        if confident or last:
+            if res is not None:
+                res = {**res, 'tier': name, 'route': route}
+            return res
+
+## LLM for Summarisation
+def T5(context, batch_size=SUMMARY_BATCH_SIZE, target_chars=SUMMARY_TARGET_CHARS, max_seconds=SUMMARY_MAX_SECONDS, max_tokens=SUMMARY_MAX_TOKENS):
+    nlp = get_pipeline('T5')
     
-def model(question, context):
+    context, prep_stats = summary_chunks(context, nlp.tokenizer, summarizer.input_prefix(nlp))
     
-    lemmatizer = WordNetLemmatizer()
-    q = word_tokenize(question)
-    q = [i.lower() for i in q]
-    q = [lemmatizer.lemmatize(i) for i in q]
+    summary, stats = summarizer.summarize(nlp, context, batch_size=batch_size, target_chars=target_chars,
+                                          max_seconds=max_seconds, max_tokens=max_tokens,
+                                          max_length=150, min_length=30, do_sample=False)
+    stats.update(prep_stats)
     
-    if  q[0] == 'summarise' or q[0] == 'summarize':
-        return T5(context), 'summarizer'
+    return [{'summary_text': summary, 'stats': stats}]
+
+## Chunks of a context for the summarizer, repeated boilerplate and copies of
+## the same text dropped so they are summarised only once. With
+## SUMMARY_EXTRACT_TOKENS set only the best sentences up to that budget are
+## kept, so the cost of generation no longer grows with the documents.
+## The tokens of the model's input prefix are kept free in every chunk.
+def summary_chunks(context, tokenizer, prefix=''):
+    context = str(context)  # documents on disk are read here
+    stats = {}
+    if extractive.SUMMARY_EXTRACT_TOKENS:
+        with metrics.span('extractive', budget=extractive.SUMMARY_EXTRACT_TOKENS):
+            context, stats['extractive'] = extractive.select(context, extractive.SUMMARY_EXTRACT_TOKENS, tokenizer)
+    chunks = chunking.chunk_for_model(context, tokenizer, reserve=chunking.prefix_tokens(tokenizer, prefix), overlap_tokens=0)
+    with metrics.span('dedup', chunks=len(chunks)):
+        chunks, stats['dedup'] = dedup.dedupe_chunks(chunks)
+    return [c['text'] for c in chunks], stats
+
+## Summary of the chunks that match the question best, e.g. "summarize the introduction"
+def summarize_section(question, context, index=None):
+    if index is not None and len(index):
+        with metrics.span('retrieve', top_k=SECTION_TOP_K):
+            context = retrieval.retrieve_context(index, question, top_k=SECTION_TOP_K)
+    return T5(context)
+
+## Named entities of the documents, in the same shape as an answer
+def entities(question, context, index=None):
+    groups = {group for group, pattern in ENTITY_TYPES if pattern.search(question)}
+    if index is not None and len(index):
+        chunks = index.chunks
     else:
-         return roberta(question, context), 'question_answering'
+        chunks = [c['text'] for c in reader_chunks(str(context), name='ner')]
+    chunks = [c for c in chunks if c.strip()]
+    if not chunks:
+        return {'answer': NO_ENTITIES, 'score': 0.0, 'entities': []}
+    try:
+        nlp = get_pipeline('ner')
+        with metrics.span('inference.ner', chunks=len(chunks)):
+            res = nlp(chunks, aggregation_strategy='simple', batch_size=QA_BATCH_SIZE)
+    except Exception as e:
+        st.error(f"An error occurred during model loading: {e}")
+        return None
 
-## LLM for Summarisation
-def T5(context):
-    tokenizer = T5Tokenizer.from_pretrained("Falconsai/text_summarization")
-    model = T5ForConditionalGeneration.from_pretrained("Falconsai/text_summarization")
+    found = {}  # (group, word) -> best score, in order of appearance
+    for chunk_entities in res:
+        for e in chunk_entities:
+            word = e['word'].strip()
+            if len(word) < 2 or e['score'] < ENTITY_MIN_SCORE or (groups and e['entity_group'] not in groups):
+                continue
+            key = (e['entity_group'], word)
+            found[key] = max(found.get(key, 0.0), float(e['score']))
 
-    nlp = pipeline('summarization', model=model, tokenizer=tokenizer)
-    
-    context = pp.get_text_chunks(context)
-    
-    res = nlp(context, max_length=150, min_length=30, do_sample=False) 
-    
-    return res
+    by_group = {}
+    for group, word in found:
+        by_group.setdefault(group, []).append(word)
+    answer = "; ".join(f"{ENTITY_LABELS.get(group, group)}: {', '.join(words)}" for group, words in by_group.items()) or NO_ENTITIES
+    return {
+        'answer': answer,
+        'score': sum(found.values()) / len(found) if found else 0.0,
+        'entities': [{'entity_group': g, 'word': w, 'score': s} for (g, w), s in found.items()],
+    }
+
+## Summaries of several contexts, with the map step of all of them batched together
+def T5_batch(contexts, batch_size=SUMMARY_BATCH_SIZE, target_chars=SUMMARY_TARGET_CHARS, max_seconds=SUMMARY_MAX_SECONDS, max_tokens=SUMMARY_MAX_TOKENS):
+    nlp = get_pipeline('T5')
+    prepared = [summary_chunks(context, nlp.tokenizer, summarizer.input_prefix(nlp)) for context in contexts]
+    results = summarizer.summarize_many(nlp, [chunks for chunks, _ in prepared], batch_size=batch_size, target_chars=target_chars,
+                                        max_seconds=max_seconds, max_tokens=max_tokens,
+                                        max_length=150, min_length=30, do_sample=False)
+    return [[{'summary_text': summary, 'stats': {**stats, **prep_stats}}]
+            for (summary, stats), (_, prep_stats) in zip(results, prepared)]
+
+## Partial summaries as a stream of text pieces for the chat to show while
+## it waits. The final summary is the generator's return value, the same one
+## model() returns and the one in the result cache; a cached summary returns
+## at once without streaming anything.
+def T5_stream(context, index=None, batch_size=SUMMARY_BATCH_SIZE, target_chars=SUMMARY_TARGET_CHARS, max_seconds=SUMMARY_MAX_SECONDS, max_tokens=SUMMARY_MAX_TOKENS):
+    key = result_cache.make_key(result_cache.document_key(context, index), 'summarizer', '', summary_id())
+    cached = result_cache.cache.get(key)
+    if cached is not None:
+        return cached[0]['summary_text']
+
+    nlp = get_pipeline('T5')
+    chunks, prep_stats = summary_chunks(context, nlp.tokenizer, summarizer.input_prefix(nlp))
+    with metrics.span('inference.summarize', chunks=len(chunks), streamed=True):
+        summary, stats = yield from summarizer.stream_summary(nlp, chunks, batch_size=batch_size, target_chars=target_chars,
+                                                              max_seconds=max_seconds, max_tokens=max_tokens,
+                                                              max_length=150, min_length=30, do_sample=False)
+    stats.update(prep_stats)
+    result_cache.cache.set(key, [{'summary_text': summary, 'stats': stats}])
+    return summary
 
 ## LLM for Question Answering
 def roberta(question, context):
+    return qa(question, context, 'roberta')
+
+## Single context answer of a reader, None when it could not be loaded or run
+## so the cascade moves on to its next tier
+def qa(question, context, name):
     try:
-        model_name = RobertaForQuestionAnswering.from_pretrained("deepset/roberta-base-squad2")
-        tokenizer = RobertaTokenizer.from_pretrained("deepset/roberta-base-squad2")
-        
-        nlp = pipeline('question-answering', model=model_name, tokenizer=tokenizer)
+        nlp = get_pipeline(name)
         QA_input = {
             'question': question,
             'context': context
         }
-        res = nlp(QA_input)
+        with metrics.span('inference.qa', model=name):
+            res = nlp(QA_input)
 
         return res
     except Exception as e:
         st.error(f"An error occurred during model loading: {e}")
         return None
 
-def bert_model(question, context):
-    
-    tokenizer = BertTokenizer.from_pretrained("google-bert/bert-base-uncased")
-    model_name = BertForQuestionAnswering.from_pretrained("google-bert/bert-base-uncased")
+## Batched Question Answering over many chunks at once
+# chunks are strings or dicts with a 'text' key, any other keys (chunk, doc, ...)
+# are copied onto the answers so they can be traced back to the source
+def roberta_chunks(question, chunks, top_k=3, batch_size=QA_BATCH_SIZE, name='roberta'):
+    return roberta_batch([(question, chunks)], top_k, batch_size, name)[0]
 
-    nlp = pipeline('question-answering', model=model_name, tokenizer=tokenizer)
-    QA_input = {
-        'question': question,
-        'context': context
-    }
-    res = nlp(QA_input) 
-    
-    return res
+## Several (question, chunks) requests answered in one pipeline call, returns
+## the ranked answers of each request
+def roberta_batch(requests, top_k=3, batch_size=QA_BATCH_SIZE, name='roberta'):
+    pairs = []  # (request position, question, chunk)
+    for r, (question, chunks) in enumerate(requests):
+        chunks = [c if isinstance(c, dict) else {'text': c, 'chunk': i} for i, c in enumerate(chunks)]
+        pairs.extend((r, question, c) for c in chunks if c['text'].strip())
+    if not pairs:
+        return [[] for _ in requests]
+    try:
+        nlp = get_pipeline(name)
+        with metrics.span('inference.qa', model=name, pairs=len(pairs)):
+            res = nlp(question=[q for _, q, _ in pairs], context=[c['text'] for _, _, c in pairs], batch_size=batch_size)
+    except Exception as e:
+        st.error(f"An error occurred during model loading: {e}")
+        return [None for _ in requests]
+
+    # The pipeline returns a bare dict instead of a list for a single input
+    if isinstance(res, dict):
+        res = [res]
+
+    answers = [[] for _ in requests]
+    for (r, _, chunk), ans in zip(pairs, res):
+        if not ans or not ans['answer'].strip():
+            continue
+        provenance = {k: v for k, v in chunk.items() if k not in ('text', 'start', 'end')}
+        ans = {**ans, **provenance}
+        # Chunks with character offsets: report the answer position in the document text
+        if 'start' in chunk:
+            ans['start'] += chunk['start']
+            ans['end'] += chunk['start']
+            ans['chunk_start'], ans['chunk_end'] = chunk['start'], chunk['end']
+        answers[r].append(ans)
+
+    for request_answers in answers:
+        request_answers.sort(key=lambda a: a['score'], reverse=True)
+        del request_answers[top_k:]
+    return answers
+
+## Chunks of a document sized for the reader, with their character offsets
+def reader_chunks(text, name='roberta'):
+    return chunking.chunk_for_model(text, get_tokenizer(name), max_length=QA_MAX_LENGTH,
+                                    reserve=QA_QUESTION_RESERVE, overlap_tokens=QA_CHUNK_OVERLAP)
+
+# Top answer in the same shape as roberta(), with the runners-up attached
+def best_answer(answers):
+    if answers is None:
+        return None
+    if not answers:
+        return {'answer': '', 'score': 0.0, 'answers': []}
+    return {**answers[0], 'answers': answers}
+
+def bert_model(question, context):
+    return qa(question, context, 'bert')
 
 def distillBert_model(question, context):
-    tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-cased-distilled-squad')
-    model_name = DistilBertForQuestionAnswering.from_pretrained('distilbert-base-cased-distilled-squad')
-    
-    nlp = pipeline('question-answering', model=model_name, tokenizer=tokenizer)
-   
-    QA_input = {
-        'question': question,
-        'context': context
-    }
-    
-    res = nlp(QA_input) 
-    
-    return res
\ No newline at end of file
+    return qa(question, context, 'distilbert')
+
+## Load the configured models once per process (WARMUP_MODELS=roberta,T5)
+def warm_up(names=None):
+    return registry.warm_up(names)
+
+# Single context readers by registry name, used by the cascade tiers
+QA_FUNCTIONS = {
+    'roberta': roberta,
+    'bert': bert_model,
+    'distilbert': distillBert_model,
+}
@@ -1,17 +1,17 @@
-from langchain.text_splitter import CharacterTextSplitter
-from nltk.tokenize import word_tokenize 
-from nltk.corpus import stopwords
-from PyPDF2 import PdfReader
-from docx import Document
-import markdown
+# LangChain, NLTK, PyPDF2, python-docx, markdown and ocr are imported in the
+# functions that use them, so opening the app does not pay for all of them
+from functools import lru_cache
 import re
-import ocr
+import doc_cache
+import extraction
+import metrics
 
 # import nltk
 # nltk.download('stopwords')
 
 def get_text_chunks(raw_text):
-    
+    from langchain.text_splitter import CharacterTextSplitter
+
     splitter = CharacterTextSplitter(
      separator=".",
      chunk_size = 2500,
@@ -22,50 +22,131 @@ def get_text_chunks(raw_text):
 
     return text_chunks
 
-def preprocess_document(docs_collection):
-    processed_text = get_text_from_files(docs_collection)
-    combined_text = "".join(processed_text)
-    combined_text = preprocess_text(combined_text)
+# Anything that changes the output of preprocess_text must change this too,
+# it is part of the cache key of the cleaned text
+PREPROCESS_SETTINGS = "newlines;stopwords=english;urls;v4"
+
+def preprocess_document(docs_collection, progress=None):
+    cleaned = preprocess_items(upload_items(docs_collection), progress)
+    combined_text = " ".join(text for text in cleaned if text)
     return combined_text
 
+# Cleaned text of every (name, file type, content, content hash) item. With
+# cache_cleaned off the cleaned text is not kept in the document cache, for
+# callers that store it themselves (the corpus); the raw text still is.
+def preprocess_items(items, progress=None, cache_cleaned=True):
+    if cache_cleaned:
+        cleaned = [doc_cache.cache.get(doc_cache.clean_key(digest, file_type, PREPROCESS_SETTINGS))
+                   for _, file_type, _, digest in items]
+    else:
+        cleaned = [None] * len(items)
+
+    # Only the files not seen before with these settings are extracted and cleaned
+    missing = [i for i, text in enumerate(cleaned) if text is None]
+    with metrics.span('extract', files=len(missing)):
+        raw_texts = extract_texts_cached([items[i] for i in missing], progress)
+    with metrics.span('clean', files=len(missing)) as fields:
+        for i, raw_text in zip(missing, raw_texts):
+            _, file_type, _, digest = items[i]
+            cleaned[i] = preprocess_text(raw_text or "")
+            if cache_cleaned:
+                doc_cache.cache.set(doc_cache.clean_key(digest, file_type, PREPROCESS_SETTINGS), cleaned[i])
+        fields['chars'] = sum(len(cleaned[i]) for i in missing)
+    return cleaned
+
+# (name, file type, content, content hash) of every upload
+def upload_items(docs_collection):
+    items = []
+    for doc in docs_collection:
+        data = doc.getvalue()
+        metrics.count('bytes_received', len(data))
+        items.append((doc.name, doc.name.split(".")[-1].lower(), data, doc_cache.content_hash(data)))
+    return items
+
+# Raw text of the items, cached ones are read from disk and the rest go to the process pool
+def extract_texts_cached(items, progress=None):
+    texts = [doc_cache.cache.get(doc_cache.extract_key(digest, file_type)) for _, file_type, _, digest in items]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    extracted = extraction.extract_texts([items[i][:3] for i in missing], progress=progress)
+    for i, text in zip(missing, extracted):
+        texts[i] = text
+        if text is not None:
+            _, file_type, _, digest = items[i]
+            doc_cache.cache.set(doc_cache.extract_key(digest, file_type), text)
+    return texts
+
 def preprocess_text(text):
+    return clean_text(text)
+
+# Original NLTK cleaning path, kept as the reference for the fast path
+def preprocess_text_nltk(text):
     text = text.replace("\n", " ")
     text = remove_stopwords(text)
     text = remove_url(text)
     return text
 
 def remove_stopwords(text):
-    stop_words = set(stopwords.words('english'))
+    from nltk.tokenize import word_tokenize
+
+    stop_words = get_stopwords()
     word_tokens = word_tokenize(text)
     
-    filtered_sentence = [w for w in word_tokens if not w.lower() in stop_words]
-    
-    filtered_sentence = []
- 
-    for w in word_tokens:
-        if w not in stop_words:
-            filtered_sentence.append(w)
+    filtered_sentence = [w for w in word_tokens if w not in stop_words]
             
     return " ".join(filtered_sentence)
 
+@lru_cache(maxsize=None)
+def get_stopwords():
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words('english'))
+
+# Splits like word_tokenize: whitespace separated words lose the punctuation
+# word_tokenize splits off (SPLIT_CHARS, quotes, ... and --) and keep the rest,
+# so "O'Neil", "10.5km/h", "C++", "-5", "a/b" and "10,000" or "10:30" stay
+# whole. Contractions are split ("do", "n't", "'s", "can", "not"). URLs are
+# matched first as a single token so they can be dropped whole. A period stays
+# on known abbreviations and dotted ones ("Mr.", "U.S.", "e.g.") unless the
+# text ends there, other words lose it like at the end of a sentence.
+# Still different from word_tokenize, which splits sentences with the Punkt
+# model first: a sentence ending in an abbreviation keeps its period here,
+# abbreviations Punkt learned that are not in ABBREVIATIONS lose it, initials
+# ("J. Smith") are split, and so is a period Punkt does not see as the end of
+# a sentence ("the model. it reads"). Stacked contractions ("they'd've") are
+# split into every part.
+ABBREVIATIONS = ('mr', 'mrs', 'ms', 'dr', 'prof', 'jr', 'sr', 'vs', 'inc', 'ltd', 'corp', 'fig', 'approx', 'dept')
+SPLIT_CHARS = '!"#$%&()*,:;<>?@[]`{}'
+_WORD_CHAR = r"[^\s" + re.escape(SPLIT_CHARS) + r"'.\-]"
+# Inside a word: hyphens (not --), apostrophes that don't start a contraction,
+# dots before more of the word, commas and colons before a digit
+_WORD = (rf"(?:{_WORD_CHAR}|-(?!-)|\.(?={_WORD_CHAR}))"
+         rf"(?:{_WORD_CHAR}|-(?!-)|'(?=\w)(?!(?:s|m|d|ll|re|ve)\b)|\.(?={_WORD_CHAR})|[:,](?=\d))*")
+TOKEN_RE = re.compile(r"http\S*|\w+?(?=n't\b)|n't\b|'(?:s|m|d|ll|re|ve)\b"
+                      r"|\b(?:can(?=not\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|wan(?=na\s))"
+                      r"|\b(?:" + "|".join(ABBREVIATIONS) + r")\.(?!\s*$)|[^\W\d_]+(?:\.[^\W\d_]+)+\.(?!\s*$)"
+                      r"|\.\.\.|--|" + _WORD + r"|\S", re.IGNORECASE)
+
+## Single pass cleaning: newlines, URLs and stopwords are all handled while tokenizing
+def clean_tokens(text):
+    stop_words = get_stopwords()
+    for match in TOKEN_RE.finditer(text):
+        token = match.group()
+        if token == '"':
+            # Opening and closing quotes become `` and '' like in word_tokenize
+            start = match.start()
+            token = '``' if start == 0 or text[start - 1].isspace() or text[start - 1] in '([{<' else "''"
+        if token not in stop_words and not token.startswith('http'):
+            yield token
+
+def clean_text(text):
+    return " ".join(clean_tokens(text))
+
 def remove_url(text):
     return re.sub(r'http\S+', '', text)
 
-def get_text_from_files(docs_collection):
-    text = ""
-    for doc in docs_collection:
-        file_type = doc.name.split(".")[-1].lower()
-        if file_type == "pdf":
-            text += read_text_from_pdf(doc)
-        elif file_type == "docx":
-            text += read_text_from_docx(doc)
-        elif file_type == "txt":
-            text += read_text_from_txt(doc)
-        elif file_type == "md":
-            text += read_text_from_md(doc)
-        elif file_type in ["jpeg", "jpg", "png"]:
-            text += read_text_from_image(doc)
-    return text
+def get_text_from_files(docs_collection, progress=None):
+    texts = extract_texts_cached(upload_items(docs_collection), progress)
+    return "".join(text for text in texts if text)
 
 def validate_file_type(file):
     allowed_extensions = ['.pdf', '.docx', '.txt', '.md', '.jpeg', '.jpg', '.png']
@@ -85,23 +166,23 @@ def validate_file_type(file):
 
 # Retreive the text from the pdf files
 def read_text_from_pdf(file):
-    text = ""
+    from PyPDF2 import PdfReader
+
     pdf_reader = PdfReader(file)
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+    return "".join(page.extract_text() for page in pdf_reader.pages)
 
 def read_text_from_docx(file):
-    text = ""
+    from docx import Document
+
     doc = Document(file)
-    for paragraph in doc.paragraphs:
-        text += paragraph.text
-    return text
+    return "".join(paragraph.text for paragraph in doc.paragraphs)
 
 def read_text_from_txt(file):
     return file.getvalue().decode("utf-8")
 
 def read_text_from_md(file):
+    import markdown
+
     return markdown.markdown(file.getvalue().decode("utf-8"))
 
 def read_text_from_file(file, file_type):
@@ -119,11 +200,14 @@ def read_text_from_file(file, file_type):
         return None  # Handle unsupported file types
     
 def read_text_from_image(file):
+    import ocr
+
     text = ocr.perform_ocr_main(file)
     return text
 
 
 # Handle Post-processing of the chat messages
+@metrics.timed('post_process')
 def post_process(messages):
     messages = capitalize_sentences(messages)
     messages = check_last_2_character(messages)
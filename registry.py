@@ -0,0 +1,150 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import metrics
+
+# name -> (pipeline task, tokenizer class, model class, checkpoint)
+MODEL_SPECS = {
+    'roberta': ('question-answering', 'RobertaTokenizer', 'RobertaForQuestionAnswering', 'deepset/roberta-base-squad2'),
+    'T5': ('summarization', 'T5Tokenizer', 'T5ForConditionalGeneration', 'Falconsai/text_summarization'),
+    'bert': ('question-answering', 'BertTokenizer', 'BertForQuestionAnswering', 'google-bert/bert-base-uncased'),
+    'distilbert': ('question-answering', 'DistilBertTokenizer', 'DistilBertForQuestionAnswering', 'distilbert-base-cased-distilled-squad'),
+    'ner': ('ner', 'BertTokenizer', 'BertForTokenClassification', 'dslim/bert-base-NER'),
+}
+
+# Default budget fits roughly two of the checkpoints at once
+DEFAULT_BUDGET_MB = 1200
+
+
+def load_pipeline(name):
+    # backends imports MODEL_SPECS from here
+    import backends
+
+    return backends.load_pipeline(name)
+
+
+# Checkpoint plus inference backend, identifies what produced a result
+def model_id(name):
+    import backends
+
+    return f"{MODEL_SPECS[name][3]}@{backends.INFERENCE_BACKEND}"
+
+
+# Fast (Rust) tokenizer for batch work such as chunking, it is small so it is
+# kept for the whole process outside the memory budget
+@lru_cache(maxsize=None)
+def get_tokenizer(name):
+    from transformers import AutoTokenizer
+
+    checkpoint = MODEL_SPECS[name][3]
+    return AutoTokenizer.from_pretrained(checkpoint, use_fast=True)
+
+
+def estimate_size_mb(nlp):
+    model = getattr(nlp, 'model', None)
+    if model is None:
+        return 0.0
+    if hasattr(model, 'state_dict'):
+        # state_dict also covers int8 packed weights, which parameters() does not
+        size = 0
+        for value in model.state_dict().values():
+            for t in (value if isinstance(value, (tuple, list)) else (value,)):
+                if hasattr(t, 'element_size'):
+                    size += t.numel() * t.element_size()
+        return size / (1024 * 1024)
+    # ONNX Runtime models: size of the exported graph files
+    directory = getattr(model, 'model_save_dir', None)
+    if directory and os.path.isdir(directory):
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(('.onnx', '.onnx_data')))
+        return size / (1024 * 1024)
+    return 0.0
+
+
+class ModelRegistry:
+
+    def __init__(self, budget_mb=None, loader=load_pipeline, sizer=estimate_size_mb):
+        if budget_mb is None:
+            budget_mb = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', DEFAULT_BUDGET_MB))
+        self.budget_mb = budget_mb
+        self.loader = loader
+        self.sizer = sizer
+        self._models = OrderedDict()  # name -> (pipeline, size in MB), oldest first
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, name):
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name][0]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Load outside the registry lock so other models stay reachable,
+        # but only once per name if several sessions ask at the same time
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    return self._models[name][0]
+            with metrics.span('model.load', model=name):
+                nlp = self.loader(name)
+            metrics.count('model_loads', model=name)
+            size = self.sizer(nlp)
+            with self._lock:
+                self._evict_for(size)
+                self._models[name] = (nlp, size)
+                self.loads += 1
+            return nlp
+
+    def _evict_for(self, size):
+        # Drop least recently used models until the new one fits the budget.
+        # A model bigger than the whole budget is still kept on its own.
+        if not self.budget_mb or self.budget_mb <= 0:
+            return
+        while self._models and self.used_mb() + size > self.budget_mb:
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+    def used_mb(self):
+        return sum(size for _, size in self._models.values())
+
+    def evict(self, name):
+        with self._lock:
+            return self._models.pop(name, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def warm_up(self, names=None):
+        if names is None:
+            names = [n.strip() for n in os.environ.get('WARMUP_MODELS', '').split(',') if n.strip()]
+        for name in names:
+            self.get(name)
+        return names
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': list(self._models),
+                'used_mb': round(self.used_mb(), 1),
+                'budget_mb': self.budget_mb,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+
+# Process-wide registry shared by every Streamlit session
+registry = ModelRegistry()
+
+
+def get_pipeline(name):
+    return registry.get(name)
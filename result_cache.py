@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+
+import metrics
+import sqlite_conn
+
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 512))
+# SQLite file shared by every session and server process, empty keeps results in memory only
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', '')
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip("?!. ")
+
+## Hash identifying the documents an answer was computed from
+def document_key(context, index=None):
+    h = hashlib.sha256()
+    segments = getattr(index, 'segments', None)
+    if segments:
+        # Per document index: the keys are already content hashes
+        for key in segments:
+            h.update(key.encode('utf-8'))
+    else:
+        text = " ".join(context) if isinstance(context, list) else str(context)
+        h.update(text.encode('utf-8'))
+    return h.hexdigest()
+
+def make_key(document_key, mode, question, model_id):
+    return "|".join([document_key, mode, normalize_question(question), model_id])
+
+## Results on disk in SQLite, so several server processes can share them. WAL
+## mode lets readers run next to a writer and SQLite does the file locking.
+class DiskStore:
+
+    def __init__(self, path, max_entries=RESULT_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._connect = sqlite_conn.ThreadConnections(path)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expiry REAL NOT NULL, value BLOB NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_by_expiry ON results (expiry)")
+
+    ## (expiry, value) of a key that has not expired yet, else None
+    def get(self, key, now):
+        row = self._connect().execute("SELECT expiry, value FROM results WHERE key = ? AND expiry >= ?", (key, now)).fetchone()
+        return (row[0], pickle.loads(row[1])) if row else None
+
+    def set(self, key, entry):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO results (key, expiry, value) VALUES (?, ?, ?)",
+                         (key, entry[0], pickle.dumps(entry[1], protocol=pickle.HIGHEST_PROTOCOL)))
+            if conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] > 2 * self.max_entries:
+                self._prune(conn, time.time())
+
+    def _prune(self, conn, now):
+        # Every entry gets the same ttl, so the earliest expiry is the oldest entry
+        conn.execute("DELETE FROM results WHERE expiry < ?", (now,))
+        conn.execute("DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY expiry DESC LIMIT ?)",
+                     (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+## In-memory LRU with a time to live, optionally backed by a SQLite file on disk.
+## The lock only guards the in-memory entries, disk reads and writes run outside it.
+class ResultCache:
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, path=RESULT_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._disk = DiskStore(path, max_entries) if path else None
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+                    self.hits += 1
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            metrics.count('cache_misses', cache='result')
+            return None
+        metrics.count('cache_hits', cache='result')
+        return entry[1]
+
+    def set(self, key, value):
+        entry = (time.time() + self.ttl, value)
+        with self._lock:
+            self._store(key, entry)
+        if self._disk is not None:
+            self._disk.set(key, entry)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            # Failed runs (None) are not cached so they are retried next time
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'entries': len(self._entries),
+        }
+
+# Process-wide cache shared by every Streamlit session
+cache = ResultCache()
@@ -0,0 +1,155 @@
+from collections import Counter, OrderedDict
+from collections.abc import Sequence
+import numpy as np
+import re
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def bm25_idf(n, df):
+    return np.log(1 + (n - df + 0.5) / (df + 0.5))
+
+## BM25 index over the text chunks, stored as term -> postings arrays. A
+## sequence of chunks is kept as it is, so lazily read chunks stay on disk.
+class BM25Index:
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks if isinstance(chunks, Sequence) else list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+
+        term_ids, doc_ids, freqs = [], [], []
+        doc_len = np.zeros(len(self.chunks), dtype=np.float32)
+        for doc_id, chunk in enumerate(self.chunks):
+            counts = Counter(tokenize(chunk))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                freqs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        self.post_docs = np.asarray(doc_ids, dtype=np.int64)[order]
+        self.post_tf = np.asarray(freqs, dtype=np.float32)[order]
+        # Postings of term t live in post_docs[ptr[t]:ptr[t + 1]]
+        self.ptr = np.searchsorted(term_ids[order], np.arange(len(self.vocab) + 1))
+
+        self.doc_len = doc_len
+        self.total_len = float(doc_len.sum())
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def df(self, term):
+        t = self.vocab.get(term)
+        return 0 if t is None else int(self.ptr[t + 1] - self.ptr[t])
+
+    # Scores for the given term -> idf weights, the corpus statistics (idf and
+    # average length) are passed in so several indexes can share them
+    def weighted_scores(self, term_idf, avgdl):
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        terms = [(self.vocab[t], w) for t, w in term_idf.items() if t in self.vocab]
+        if not terms or not avgdl:
+            return scores
+
+        docs = np.concatenate([self.post_docs[self.ptr[t]:self.ptr[t + 1]] for t, _ in terms])
+        tf = np.concatenate([self.post_tf[self.ptr[t]:self.ptr[t + 1]] for t, _ in terms])
+        idf = np.concatenate([np.full(self.ptr[t + 1] - self.ptr[t], w, dtype=np.float32) for t, w in terms])
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / avgdl)
+        weights = idf * tf * (self.k1 + 1) / (tf + norm)
+        np.add.at(scores, docs, weights)
+        return scores
+
+    def scores(self, query):
+        n = len(self.chunks)
+        term_idf = {t: bm25_idf(n, self.df(t)) for t in set(tokenize(query))}
+        return self.weighted_scores(term_idf, self.total_len / n if n else 0.0)
+
+    def search(self, query, top_k=4):
+        return top_hits(self.scores(query), top_k)
+
+    def hits(self, query, top_k=4):
+        hits = self.search(query, top_k) or [(i, 0.0) for i in range(min(top_k, len(self)))]
+        return [{"text": self.chunks[i], "chunk": i, "retrieval_score": score} for i, score in hits]
+
+def top_hits(scores, top_k):
+    if not len(scores) or top_k <= 0:
+        return []
+    top_k = min(top_k, len(scores))
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+## One BM25 segment per document, so documents can be added and removed
+## without re-indexing the others. Scores use statistics of all segments.
+class SegmentedIndex:
+
+    def __init__(self):
+        self.segments = OrderedDict()  # key -> (BM25Index, metadata copied onto hits)
+        self.chunk_meta = {}  # key -> per chunk metadata (offsets, ...) copied onto hits
+
+    # chunks are strings or dicts with a 'text' key and extra per chunk metadata
+    def add(self, key, chunks, **meta):
+        texts = [c['text'] if isinstance(c, dict) else c for c in chunks]
+        self.segments[key] = (BM25Index(texts), meta)
+        self.chunk_meta[key] = [{k: v for k, v in c.items() if k != 'text'} if isinstance(c, dict) else {} for c in chunks]
+
+    # A segment built elsewhere, e.g. shared by every session with the same document
+    def add_index(self, key, index, chunk_meta, **meta):
+        self.segments[key] = (index, meta)
+        self.chunk_meta[key] = chunk_meta
+
+    def remove(self, key):
+        self.chunk_meta.pop(key, None)
+        return self.segments.pop(key, None) is not None
+
+    def __contains__(self, key):
+        return key in self.segments
+
+    def __len__(self):
+        return sum(len(seg) for seg, _ in self.segments.values())
+
+    @property
+    def chunks(self):
+        return [chunk for seg, _ in self.segments.values() for chunk in seg.chunks]
+
+    def hits(self, query, top_k=4):
+        n = len(self)
+        if not n:
+            return []
+        avgdl = sum(seg.total_len for seg, _ in self.segments.values()) / n
+        term_idf = {}
+        for term in set(tokenize(query)):
+            df = sum(seg.df(term) for seg, _ in self.segments.values())
+            if df:
+                term_idf[term] = bm25_idf(n, df)
+
+        hits = []
+        for position, (key, (seg, meta)) in enumerate(self.segments.items()):
+            for i, score in top_hits(seg.weighted_scores(term_idf, avgdl), top_k):
+                hits.append({"text": seg.chunks[i], "chunk": i, "segment": position, "retrieval_score": score,
+                             **meta, **self.chunk_meta[key][i]})
+        hits.sort(key=lambda h: h["retrieval_score"], reverse=True)
+
+        if not hits:
+            for position, (key, (seg, meta)) in enumerate(self.segments.items()):
+                hits.extend({"text": c, "chunk": i, "segment": position, "retrieval_score": 0.0, **meta, **self.chunk_meta[key][i]}
+                            for i, c in enumerate(seg.chunks[:top_k]))
+                if len(hits) >= top_k:
+                    break
+        return hits[:top_k]
+
+## Best matching chunks with their position in the corpus as provenance
+def retrieve(index, question, top_k=4):
+    return index.hits(question, top_k)
+
+## Join the best matching chunks, kept in document order, as the reader context.
+## Chunk numbers restart in every segment (document), so order by segment first.
+def retrieve_context(index, question, top_k=4):
+    hits = sorted(retrieve(index, question, top_k), key=lambda c: (c.get("segment", 0), c["chunk"]))
+    return " ".join(c["text"] for c in hits)
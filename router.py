@@ -0,0 +1,146 @@
+from collections import Counter
+from functools import lru_cache
+import math
+import os
+import re
+
+# 'rules' only tells summaries from questions, 'classifier' also knows the
+# intents in EXTRA_INTENTS
+ROUTER = os.environ.get('ROUTER', 'rules')
+
+SUMMARIZE = 'summarizer'
+QUESTION = 'question_answering'
+SUMMARIZE_SECTION = 'summarize_section'
+LIST_ENTITIES = 'list_entities'
+EXTRA_INTENTS = (SUMMARIZE_SECTION, LIST_ENTITIES)
+
+# Rules only look at the start of the question
+LEAD_CHARS = 80
+
+# (intent, pattern matched at the start of the question), first match wins
+RULES = [
+    (SUMMARIZE, r"summari[sz]e\b"),
+]
+
+# Checked before the classifier, for the phrasings that need no guessing
+CLASSIFIER_RULES = [
+    (SUMMARIZE_SECTION, r"summari[sz]e\s+(?:the\s+)?(?:(?:\w+\s+){0,3}(?:section|chapter|part|paragraph)"
+                        r"|introduction|conclusions?|abstract|background|methods?|results|discussion)\b"),
+    (LIST_ENTITIES, r"(?:list|name|show)\s+(?:all\s+|every\s+|the\s+)*(?:people|persons|names|companies|organi[sz]ations|places|locations|entities)\b"),
+] + RULES
+
+# The classifier only lists entities for questions that name a kind of entity
+ENTITY_TYPES = re.compile(r"\b(?:people|persons?|names?|compan(?:y|ies)|organi[sz]ations?|firms?|places?|locations?"
+                          r"|cit(?:y|ies)|countr(?:y|ies)|dates?|entities)\b", re.IGNORECASE)
+
+## Intent from precompiled regular expressions on the leading characters
+class RuleRouter:
+
+    def __init__(self, rules=RULES, default=QUESTION):
+        self.intents = [intent for intent, _ in rules]
+        self.default = default
+        self.pattern = re.compile(r"\W*(?:" + "|".join(f"(?P<r{i}>{p})" for i, (_, p) in enumerate(rules)) + ")",
+                                  re.IGNORECASE)
+
+    def match(self, question):
+        m = self.pattern.match(question[:LEAD_CHARS])
+        return self.intents[int(m.lastgroup[1:])] if m else None
+
+    def __call__(self, question):
+        return self.match(question) or self.default
+
+# A few phrasings of every intent, the classifier compares questions against them
+EXAMPLES = {
+    SUMMARIZE: [
+        "summarize the document", "summarise these files", "give me a summary", "summary please",
+        "what is this document about", "sum up the report", "tl;dr", "overview of the documents",
+        "main points of the text", "brief summary of everything",
+    ],
+    SUMMARIZE_SECTION: [
+        "summarize the introduction", "summary of section 3", "summarise the conclusion",
+        "sum up chapter two", "what does the methods section say", "summarize the part about pricing",
+        "give me a summary of the results section", "overview of the chapter on security",
+        "brief summary of the discussion section", "summarize the background part",
+    ],
+    LIST_ENTITIES: [
+        "list all people mentioned", "which companies are named", "list the organisations",
+        "who are all the people in the document", "what places are mentioned", "list the names",
+        "which organizations appear", "all locations in the text", "name every person", "list entities",
+    ],
+    QUESTION: [
+        "what is the price", "when was the contract signed", "who is the author", "how many users are there",
+        "where is the office", "why did revenue grow", "what does the report recommend",
+        "how long does the contract run", "who created python", "which year was it founded",
+        "what are the main risks", "what are the payment terms", "what are the key findings",
+        "who are the people responsible for safety", "what is the main reason for the delay",
+        "what are the requirements", "what is the point of the new policy",
+    ],
+}
+
+def features(text):
+    words = re.findall(r"\w+", text.lower())
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+## Nearest centroid over word and word pair counts of EXAMPLES, with the
+## rules tried first. Another intent than the default has to score at least
+## min_similarity and beat the default by margin, so questions sharing a few
+## words with the examples ("what are the ...") stay questions. Decisions are
+## cached by normalised question.
+class ClassifierRouter:
+
+    def __init__(self, examples=EXAMPLES, rules=CLASSIFIER_RULES, default=QUESTION, min_similarity=0.2, margin=0.1,
+                 cache_size=1024):
+        self.rules = RuleRouter(rules, default=None)
+        self.default = default
+        self.min_similarity = min_similarity
+        self.margin = margin
+        docs = {intent: [features(e) for e in phrases] for intent, phrases in examples.items()}
+        n_docs = sum(len(d) for d in docs.values())
+        df = Counter(term for d in docs.values() for f in d for term in f)
+        self.idf = {term: math.log(n_docs / n) + 1 for term, n in df.items()}
+        self.centroids = {intent: self.normalise(sum(d, Counter())) for intent, d in docs.items()}
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def normalise(self, counts):
+        weights = {t: c * self.idf.get(t, 0.0) for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {t: w / norm for t, w in weights.items() if w}
+
+    def scores(self, question):
+        vec = self.normalise(features(question))
+        return {intent: sum(w * centroid.get(t, 0.0) for t, w in vec.items()) for intent, centroid in self.centroids.items()}
+
+    def _classify(self, question):
+        intent = self.rules.match(question)
+        if intent:
+            return intent
+        scores = self.scores(question)
+        if not ENTITY_TYPES.search(question):
+            scores.pop(LIST_ENTITIES, None)
+        best = max(scores, key=scores.get)
+        if best == self.default:
+            return best
+        if scores[best] < self.min_similarity or scores[best] - scores.get(self.default, 0.0) < self.margin:
+            return self.default
+        return best
+
+    def __call__(self, question):
+        return self.classify(" ".join(question.lower().split()))
+
+ROUTERS = {
+    'rules': RuleRouter,
+    'classifier': ClassifierRouter,
+}
+
+_router = None
+
+def get_router():
+    global _router
+    if _router is None:
+        if ROUTER not in ROUTERS:
+            raise ValueError(f"Unknown router {ROUTER!r}, expected one of {', '.join(ROUTERS)}")
+        _router = ROUTERS[ROUTER]()
+    return _router
+
+def route(question):
+    return get_router()(question)
@@ -0,0 +1,243 @@
+# Headless serving of the chatbot without Streamlit.
+#   python server.py serve [--host 127.0.0.1] [--port 8000]
+#   python server.py ask --docs report.pdf notes.docx --questions questions.txt [--out answers.jsonl]
+# Concurrent questions are grouped into micro-batches so one model instance
+# answers many clients per forward pass.
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+
+from batching import MicroBatcher
+from docstore import DocumentStore
+from extraction import NamedBytesIO
+from registry import registry
+import metrics
+import model as md
+import preprocess as pp
+import result_cache
+import retrieval
+import router
+
+# How long the first request of a batch waits for others to join
+BATCH_WINDOW = float(os.environ.get('BATCH_WINDOW_MS', 20)) / 1000
+QA_MAX_BATCH = int(os.environ.get('QA_MAX_BATCH', 16))
+SUMMARY_MAX_BATCH = int(os.environ.get('SUMMARY_MAX_BATCH', 4))
+# Document sets kept in memory, least recently used dropped first, and seconds
+# an unused set is kept. A dropped id gets 404 and has to be uploaded again.
+DOCUMENT_SETS_MAX = int(os.environ.get('DOCUMENT_SETS_MAX', 64))
+DOCUMENT_SETS_TTL = float(os.environ.get('DOCUMENT_SETS_TTL', 3600))
+
+qa_batcher = MicroBatcher(md.roberta_batch, QA_MAX_BATCH, BATCH_WINDOW, name='qa-batcher')
+summary_batcher = MicroBatcher(md.T5_batch, SUMMARY_MAX_BATCH, BATCH_WINDOW, name='summary-batcher')
+
+# Processed document sets by id, shared by every client: id -> (last used, store)
+document_sets = OrderedDict()
+document_sets_lock = threading.Lock()
+
+# Called with the lock held. Dropping a store lets the corpus unmap and
+# evict its files once no other set uses them.
+def evict_documents(now):
+    while document_sets and (len(document_sets) > DOCUMENT_SETS_MAX
+                             or next(iter(document_sets.values()))[0] < now - DOCUMENT_SETS_TTL):
+        document_sets.popitem(last=False)
+
+## Process (name, bytes) files into a document set, returns its id
+def load_documents(files):
+    store = DocumentStore()
+    store.sync([NamedBytesIO(data, name) for name, data in files])
+    set_id = result_cache.document_key(store.context(), store.index)
+    now = time.time()
+    with document_sets_lock:
+        document_sets[set_id] = (now, store)
+        document_sets.move_to_end(set_id)
+        evict_documents(now)
+    return set_id, store
+
+def get_documents(set_id):
+    now = time.time()
+    with document_sets_lock:
+        evict_documents(now)
+        entry = document_sets.get(set_id)
+        if entry is None:
+            return None
+        document_sets[set_id] = (now, entry[1])
+        document_sets.move_to_end(set_id)
+        return entry[1]
+
+## Same routing and result cache as model.model(), with the inference going
+## through the micro-batchers
+def ask(store, question):
+    with metrics.trace('question'):
+        return ask_traced(store, question)
+
+def ask_traced(store, question):
+    context, index = store.context(), store.index
+    doc_key = result_cache.document_key(context, index)
+
+    mode = md.route(question)
+    if mode in router.EXTRA_INTENTS:
+        # Rare enough to skip the micro-batchers
+        res, mode = md.model(question, context, index)
+        if res is None:
+            return {'mode': mode, 'error': f'{mode} failed'}
+        if mode in md.SUMMARY_MODES:
+            return {'mode': mode, 'answer': finish(res[0]['summary_text'])}
+        return {'mode': mode, 'answer': finish(res['answer']), 'entities': res.get('entities', [])}
+
+    if mode == 'summarizer':
+        key = result_cache.make_key(doc_key, 'summarizer', '', md.summary_id())
+        res = result_cache.cache.get_or_compute(key, lambda: summary_batcher(context))
+        return {'mode': 'summarizer', 'answer': finish(res[0]['summary_text'])}
+
+    def run():
+        chunks = retrieval.retrieve(index, question, top_k=md.RETRIEVAL_TOP_K)
+        return md.best_answer(qa_batcher((question, chunks)))
+
+    key = result_cache.make_key(doc_key, 'question_answering', question, md.model_id('roberta'))
+    res = result_cache.cache.get_or_compute(key, run)
+    if res is None:
+        return {'mode': 'question_answering', 'error': 'question answering failed'}
+    return {
+        'mode': 'question_answering',
+        'answer': finish(res['answer']),
+        'score': res['score'],
+        'doc': res.get('doc'),
+        'answers': [{k: v for k, v in a.items() if k != 'route'} for a in res.get('answers', [])],
+    }
+
+def finish(text):
+    return pp.post_process(text) if text.strip() else text
+
+def ask_many(store, questions, workers=QA_MAX_BATCH):
+    # Asked from several threads at once so the batchers can group them
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda q: ask(store, q), questions))
+
+def stats():
+    return {
+        'models': registry.stats(),
+        'result_cache': result_cache.cache.stats(),
+        'qa_batches': qa_batcher.stats(),
+        'summary_batches': summary_batcher.stats(),
+        'document_sets': len(document_sets),
+    }
+
+class Handler(BaseHTTPRequestHandler):
+
+    def send_text(self, status, text):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self.send_json(200, stats())
+        elif self.path == '/metrics':
+            self.send_text(200, metrics.render())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        try:
+            body = self.read_json()
+        except ValueError:
+            return self.send_json(400, {'error': 'invalid JSON'})
+
+        try:
+            if self.path == '/documents':
+                # {"files": [{"name": "report.pdf", "content": "<base64>"}]}
+                files = [(f['name'], base64.b64decode(f['content'])) for f in body.get('files', [])]
+                if not files:
+                    return self.send_json(400, {'error': 'no files'})
+                set_id, store = load_documents(files)
+                self.send_json(200, {'documents': set_id, 'files': store.names()})
+            elif self.path == '/ask':
+                # {"documents": "<id>", "question": "..."} or "questions": [...]
+                store = get_documents(body.get('documents'))
+                if store is None:
+                    return self.send_json(404, {'error': 'unknown or expired documents, upload them to /documents again'})
+                if 'questions' in body:
+                    self.send_json(200, {'answers': ask_many(store, body['questions'])})
+                elif body.get('question'):
+                    self.send_json(200, ask(store, body['question']))
+                else:
+                    self.send_json(400, {'error': 'no question'})
+            else:
+                self.send_json(404, {'error': 'not found'})
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+def serve(host, port):
+    md.warm_up()
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def ask_files(doc_paths, questions_path, out_path=None):
+    files = []
+    for path in doc_paths:
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read()))
+    _, store = load_documents(files)
+
+    with open(questions_path, encoding='utf-8') as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    out = open(out_path, 'w', encoding='utf-8') if out_path else sys.stdout
+    try:
+        for question, answer in zip(questions, ask_many(store, questions)):
+            out.write(json.dumps({'question': question, **answer}) + '\n')
+    finally:
+        if out_path:
+            out.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless document QA and summarisation")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_cmd = commands.add_parser('serve', help="run the HTTP API")
+    serve_cmd.add_argument('--host', default='127.0.0.1')
+    serve_cmd.add_argument('--port', type=int, default=8000)
+
+    ask_cmd = commands.add_parser('ask', help="answer a file of questions, one per line")
+    ask_cmd.add_argument('--docs', nargs='+', required=True)
+    ask_cmd.add_argument('--questions', required=True)
+    ask_cmd.add_argument('--out')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    else:
+        ask_files(args.docs, args.questions, args.out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import sqlite3
+import threading
+
+## One SQLite connection per thread to a file in WAL mode, so readers run next
+## to a writer and several processes can share the file. Call it for the
+## connection of the current thread, sqlite connections can't be shared
+## between threads.
+class ThreadConnections:
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,176 @@
+from threading import Thread
+import queue
+import time
+
+import metrics
+
+# Partial summaries are regrouped into pieces no longer than a preprocess chunk
+GROUP_CHARS = 2500
+
+# Longest wait (seconds) for the next streamed token before giving up
+STREAM_TIMEOUT = 120
+
+## Keeps track of the time and token budget shared by every summarisation round
+class Budget:
+
+    def __init__(self, max_seconds=None, max_tokens=None):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.start = time.monotonic()
+        self.tokens = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def exhausted(self):
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return True
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        return False
+
+def count_tokens(nlp, texts):
+    tokenizer = getattr(nlp, 'tokenizer', None)
+    if tokenizer is None:
+        return sum(len(t.split()) for t in texts)
+    return sum(len(ids) for ids in tokenizer(texts)['input_ids'])
+
+## Map step: summarise the texts batch by batch until the budget runs out
+def map_step(nlp, texts, budget, stats, batch_size=8, **generate_kwargs):
+    summaries = []
+    for i in range(0, len(texts), batch_size):
+        if budget.exhausted():
+            stats['skipped'] += len(texts) - i
+            stats['truncated'] = True
+            break
+        batch = texts[i:i + batch_size]
+        n_tokens = count_tokens(nlp, batch)
+        budget.tokens += n_tokens
+        metrics.count('tokens', n_tokens, stage='summarize')
+        with metrics.span('inference.summarize', texts=len(batch)):
+            res = nlp(batch, batch_size=batch_size, **generate_kwargs)
+        summaries.extend(r['summary_text'] for r in res)
+        stats['calls'] += len(batch)
+    return summaries
+
+## Pack consecutive partial summaries into groups for the next round
+def group_texts(texts, group_chars=GROUP_CHARS):
+    groups, current = [], ""
+    for text in texts:
+        if current and len(current) + len(text) + 1 > group_chars:
+            groups.append(current)
+            current = text
+        else:
+            current = f"{current} {text}" if current else text
+    if current:
+        groups.append(current)
+    return groups
+
+## Map-reduce summarisation: summarise every chunk, then keep summarising the
+## partial summaries until they fit in target_chars or the budget is spent
+def summarize(nlp, chunks, batch_size=8, target_chars=1500, max_seconds=None, max_tokens=None, max_rounds=4, **generate_kwargs):
+    return summarize_many(nlp, [chunks], batch_size, target_chars, max_seconds, max_tokens, max_rounds, **generate_kwargs)[0]
+
+## Same for several documents sets at once: the map step of all of them runs
+## as one batched job, then each is reduced on its own. They share the budget.
+def summarize_many(nlp, chunk_lists, batch_size=8, target_chars=1500, max_seconds=None, max_tokens=None, max_rounds=4, **generate_kwargs):
+    budget = Budget(max_seconds, max_tokens)
+    map_stats = {'rounds': 1, 'calls': 0, 'skipped': 0, 'truncated': False}
+    all_chunks = [chunk for chunks in chunk_lists for chunk in chunks]
+    all_partials = map_step(nlp, all_chunks, budget, map_stats, batch_size, **generate_kwargs)
+
+    results, start = [], 0
+    for chunks in chunk_lists:
+        partials = all_partials[start:start + len(chunks)]
+        start += len(chunks)
+        stats = dict(map_stats)
+        results.append(reduce_partials(nlp, partials, budget, stats, batch_size, target_chars, max_rounds, **generate_kwargs))
+    return results
+
+def reduce_partials(nlp, partials, budget, stats, batch_size=8, target_chars=1500, max_rounds=4, **generate_kwargs):
+    while len(" ".join(partials)) > target_chars and len(partials) > 1 and stats['rounds'] < max_rounds:
+        if budget.exhausted():
+            stats['truncated'] = True
+            break
+        groups = group_texts(partials)
+        # Nothing left to merge, another round would not get any shorter
+        if len(groups) == len(partials):
+            break
+        reduced = map_step(nlp, groups, budget, stats, batch_size, **generate_kwargs)
+        if not reduced:
+            break
+        # Groups cut off by the budget are carried over as they are
+        partials = reduced + groups[len(reduced):]
+        stats['rounds'] += 1
+
+    summary = " ".join(partials)
+    if len(summary) > target_chars:
+        stats['truncated'] = True
+        summary = cut_to_sentence(summary, target_chars)
+
+    stats['tokens'] = budget.tokens
+    stats['seconds'] = round(budget.elapsed(), 3)
+    return summary, stats
+
+def cut_to_sentence(text, limit):
+    cut = text[:limit]
+    end = cut.rfind('.')
+    return cut[:end + 1] if end > 0 else cut
+
+# Task prefix the pipeline puts before every input ("summarize: " for T5)
+def input_prefix(nlp):
+    return getattr(nlp.model.config, 'prefix', None) or ''
+
+## Generated text of one input as it is produced. generate() runs in a
+## thread, an error there is raised here and a stalled generation raises
+## TimeoutError after timeout seconds without a token.
+def stream_generate(nlp, text, budget, max_input_length=512, timeout=STREAM_TIMEOUT, **generate_kwargs):
+    from transformers import TextIteratorStreamer
+
+    inputs = nlp.tokenizer(input_prefix(nlp) + text, return_tensors='pt', truncation=True, max_length=max_input_length)
+    budget.tokens += inputs['input_ids'].shape[-1]
+
+    streamer = TextIteratorStreamer(nlp.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    errors = []
+
+    def generate():
+        try:
+            nlp.model.generate(**inputs, **generate_kwargs, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # wakes up the reader
+
+    thread = Thread(target=generate, daemon=True)
+    thread.start()
+    try:
+        yield from streamer
+    except queue.Empty:
+        raise TimeoutError(f"no summary text generated for {timeout} s") from None
+    thread.join(timeout)
+    if errors:
+        raise errors[0]
+
+## Streaming variant for the chat: the map step streams the summary of every
+## chunk as it is generated, then the partial summaries are reduced like in
+## summarize(). Only the partials are yielded, the final (summary, stats) is
+## the generator's return value, the same as summarize() returns.
+def stream_summary(nlp, chunks, batch_size=8, target_chars=1500, max_seconds=None, max_tokens=None, max_rounds=4,
+                   max_input_length=512, timeout=STREAM_TIMEOUT, **generate_kwargs):
+    budget = Budget(max_seconds, max_tokens)
+    stats = {'rounds': 1, 'calls': 0, 'skipped': 0, 'truncated': False}
+    partials = []
+    for i, chunk in enumerate(chunks):
+        if budget.exhausted():
+            stats['skipped'] += len(chunks) - i
+            stats['truncated'] = True
+            break
+        if i:
+            yield " "
+        pieces = []
+        for text in stream_generate(nlp, chunk, budget, max_input_length, timeout, **generate_kwargs):
+            pieces.append(text)
+            yield text
+        partials.append("".join(pieces).strip())
+        stats['calls'] += 1
+
+    return reduce_partials(nlp, partials, budget, stats, batch_size, target_chars, max_rounds, **generate_kwargs)